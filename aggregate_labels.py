@@ -0,0 +1,238 @@
+import argparse
+import json
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from os.path import join, isdir
+
+import numpy as np
+import pandas as pd
+
+from labels_files import find_labels_files
+
+# Consolidate every annotator's {annotator}_{exp}_labels.csv for an experiment:
+# majority labels per question, Cohen's/Fleiss' kappa between annotators and
+# agreement of the LLM's confusion label with the humans.
+#
+#   python aggregate_labels.py expA expB --jobs 2 --out-dir aggregated
+#
+# Labels files are read in chunks and only the latest label per annotator and
+# question is kept, so memory grows with the number of questions, not label rows.
+# Journal records not yet compacted into a CSV are replayed on top of it, and an
+# annotator with rows in the sqlite database (--db) is read from there instead.
+
+question_key = ['doc_id', 'q_id', 'is_confusing']
+label_columns = ['llm_confuse_label', 'human_confuse_label', 'human_defuse_label']
+# "Did not select" and anything else that is not Yes/No is left out of the statistics
+label_codes = {"Yes": 1, "No": 0}
+
+
+def encode_labels(labels):
+    labels = labels.rename(columns={'supposed_to_be_confusing': 'is_confusing'})
+    for column in label_columns:
+        labels[column] = labels[column].map(label_codes).astype("Int8")
+    return labels
+
+
+def read_latest_labels(path, chunksize):
+    # Last write wins per question, like append_row_to_csv's overwrite
+    columns = ['doc_id', 'q_id', 'supposed_to_be_confusing'] + label_columns
+    chunks = pd.read_csv(path, chunksize=chunksize, usecols=columns) if os.path.exists(path) else []
+    # Records from an interrupted compaction come before the live journal
+    records = read_journal(path + ".journal.compacting") + read_journal(path + ".journal")
+    if records:
+        chunks = [*chunks, pd.DataFrame(records, columns=columns)]
+    latest = None
+    for chunk in chunks:
+        chunk = encode_labels(chunk[columns])
+        latest = chunk if latest is None else pd.concat([latest, chunk], ignore_index=True)
+        latest = latest.drop_duplicates(subset=question_key, keep='last')
+    return latest
+
+
+def read_journal(path):
+    records = []
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # Torn by a crash mid-write, that submit never succeeded
+                    continue
+    return records
+
+
+def read_db_labels(db_path, exp_name):
+    # annotator -> labels from the app's sqlite storage (ANNOTATION_STORAGE=sqlite)
+    if not db_path or not os.path.exists(db_path):
+        return {}
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        labels = pd.read_sql_query(
+            "SELECT annotator, doc_id, q_id, supposed_to_be_confusing, "
+            f"{', '.join(label_columns)} FROM annotations WHERE experiment = ? ORDER BY rowid",
+            conn,
+            params=[exp_name],
+        )
+    except pd.errors.DatabaseError:
+        # No annotations table, the app never stored anything there
+        return {}
+    finally:
+        conn.close()
+    # SQLite hands booleans back as 0/1
+    labels['supposed_to_be_confusing'] = labels['supposed_to_be_confusing'].astype(bool)
+    return {
+        annotator: encode_labels(annotator_labels.drop(columns='annotator'))
+        for annotator, annotator_labels in labels.groupby('annotator', sort=True)
+    }
+
+
+def read_questions(experiment_dir, chunksize):
+    # Every (topic, doc_id, q_id, is_confusing) of the experiment. Labels files
+    # do not record the topic so it is recovered from qrc_out.csv, a question
+    # whose ids appear in two topics is counted under both.
+    questions = []
+    for topic in sorted(os.listdir(experiment_dir)):
+        qrc_path = join(experiment_dir, topic, "qrc_out.csv")
+        if not os.path.exists(qrc_path):
+            continue
+        for chunk in pd.read_csv(qrc_path, chunksize=chunksize, usecols=question_key):
+            questions.append(chunk.assign(topic=topic))
+    if not questions:
+        return pd.DataFrame(columns=['topic'] + question_key)
+    return pd.concat(questions, ignore_index=True).drop_duplicates()
+
+
+def majority_labels(labels):
+    grouped = labels.groupby(['topic'] + question_key, sort=False)
+    majority = pd.DataFrame({'n_annotators': grouped['annotator'].nunique()})
+    for column, name in [('human_confuse_label', 'confuse'), ('human_defuse_label', 'defuse')]:
+        yes = grouped[column].sum()
+        no = grouped[column].count() - yes
+        majority[f'{name}_yes'] = yes
+        majority[f'{name}_no'] = no
+        majority[f'majority_{name}'] = np.select(
+            [yes > no, no > yes, yes + no == 0], ["Yes", "No", ""], default="Tie"
+        )
+    # The LLM label comes from the question itself, every annotator saved the same one
+    majority['llm_confuse_label'] = grouped['llm_confuse_label'].first().map({1: "Yes", 0: "No"}).fillna("")
+    return majority.reset_index()
+
+
+def fleiss_kappa(labels, column):
+    # Binary Fleiss' kappa, items may have different numbers of raters
+    grouped = labels.dropna(subset=[column]).groupby(['topic'] + question_key, sort=False)[column]
+    n = grouped.count().to_numpy(dtype=float)
+    yes = grouped.sum().to_numpy(dtype=float)
+    rated = n >= 2
+    n, yes = n[rated], yes[rated]
+    if len(n) == 0:
+        return None
+    no = n - yes
+    agreement = ((yes ** 2 + no ** 2 - n) / (n * (n - 1))).mean()
+    p_yes = yes.sum() / n.sum()
+    chance = p_yes ** 2 + (1 - p_yes) ** 2
+    return None if chance == 1 else float((agreement - chance) / (1 - chance))
+
+
+def cohen_kappa(first, second):
+    both = first.notna() & second.notna()
+    first, second = first[both].to_numpy(dtype=float), second[both].to_numpy(dtype=float)
+    if len(first) == 0:
+        return None, 0
+    observed = (first == second).mean()
+    chance = first.mean() * second.mean() + (1 - first.mean()) * (1 - second.mean())
+    kappa = None if chance == 1 else float((observed - chance) / (1 - chance))
+    return kappa, int(len(first))
+
+
+def agreement(labels, majority):
+    summary = {'annotators': sorted(labels['annotator'].unique().tolist()), 'questions_labeled': len(majority)}
+    for column in ['human_confuse_label', 'human_defuse_label']:
+        wide = labels.pivot_table(index=['topic'] + question_key, columns='annotator', values=column, aggfunc='last')
+        pairwise = {}
+        for first, second in combinations(wide.columns, 2):
+            kappa, n = cohen_kappa(wide[first], wide[second])
+            pairwise[f"{first} vs {second}"] = {'cohen_kappa': kappa, 'n': n}
+        summary[column] = {'fleiss_kappa': fleiss_kappa(labels, column), 'pairwise': pairwise}
+
+    # LLM vs human on "is this question confusing?", per annotator and against the majority
+    llm = {}
+    for annotator, annotator_labels in labels.groupby('annotator'):
+        kappa, n = cohen_kappa(annotator_labels['llm_confuse_label'], annotator_labels['human_confuse_label'])
+        matches = (annotator_labels['llm_confuse_label'] == annotator_labels['human_confuse_label']).sum()
+        llm[annotator] = {'cohen_kappa': kappa, 'agreement': float(matches / n) if n else None, 'n': n}
+    decided = majority[majority['majority_confuse'].isin(["Yes", "No"]) & majority['llm_confuse_label'].isin(["Yes", "No"])]
+    kappa, n = cohen_kappa(decided['llm_confuse_label'].map(label_codes), decided['majority_confuse'].map(label_codes))
+    llm['majority'] = {
+        'cohen_kappa': kappa,
+        'agreement': float((decided['llm_confuse_label'] == decided['majority_confuse']).mean()) if n else None,
+        'n': n,
+    }
+    summary['llm_vs_human_confuse'] = llm
+    return summary
+
+
+def aggregate_experiment(exp_name, experiment_folder, labels_dir, out_dir, chunksize, db_path=None):
+    questions = read_questions(join(experiment_folder, exp_name), chunksize)
+    labels = []
+    exp_folders = [f for f in os.listdir(experiment_folder) if isdir(join(experiment_folder, f))]
+    # The database has an annotator's labels once they opened the experiment in
+    # sqlite mode (their CSV is imported then), the CSV is only older history
+    db_labels = read_db_labels(db_path, exp_name)
+    labels_files = find_labels_files(labels_dir, exp_name, exp_folders)
+    for annotator in sorted(set(labels_files) | set(db_labels)):
+        if annotator in db_labels:
+            latest = db_labels[annotator]
+        else:
+            latest = read_latest_labels(labels_files[annotator], chunksize)
+        if latest is None:
+            continue
+        # Only labels for questions that still exist in the experiment
+        latest = latest.merge(questions, on=question_key, how='inner')
+        labels.append(latest.assign(annotator=annotator))
+    if not labels:
+        return exp_name, {'annotators': [], 'questions_labeled': 0}
+
+    labels = pd.concat(labels, ignore_index=True)
+    majority = majority_labels(labels)
+    summary = agreement(labels, majority)
+
+    os.makedirs(out_dir, exist_ok=True)
+    majority.to_csv(join(out_dir, f"{exp_name}_majority_labels.csv"), index=False)
+    with open(join(out_dir, f"{exp_name}_agreement.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return exp_name, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate annotators' labels and compute agreement per experiment")
+    parser.add_argument("experiments", nargs="*", help="Experiment names (default: every folder under --experiment-folder)")
+    parser.add_argument("--experiment-folder", default=join(os.getcwd(), "experiment"))
+    parser.add_argument("--labels-dir", default=os.getcwd(), help="Where the {annotator}_{exp}_labels.csv files are")
+    parser.add_argument("--out-dir", default=join(os.getcwd(), "aggregated"))
+    parser.add_argument("--db", default=os.environ.get("ANNOTATION_DB", join(os.getcwd(), "annotations.sqlite3")),
+                        help="The app's sqlite annotation database, if ANNOTATION_STORAGE=sqlite was used")
+    parser.add_argument("--chunksize", type=int, default=100_000, help="Rows read at a time from each CSV")
+    parser.add_argument("--jobs", type=int, default=1, help="Experiments processed in parallel")
+    args = parser.parse_args()
+
+    experiments = args.experiments or sorted(
+        f for f in os.listdir(args.experiment_folder) if isdir(join(args.experiment_folder, f))
+    )
+    jobs = [(exp_name, args.experiment_folder, args.labels_dir, args.out_dir, args.chunksize, args.db) for exp_name in experiments]
+    if args.jobs > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            results = list(pool.map(aggregate_experiment, *zip(*jobs)))
+    else:
+        results = [aggregate_experiment(*job) for job in jobs]
+
+    for exp_name, summary in results:
+        print(f"## {exp_name}")
+        print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
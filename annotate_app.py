@@ -1,18 +1,198 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv
+import pyarrow.compute
 import os
-from os.path import join, exists
+import cProfile
+import csv
+import io
+import json
+import logging
+import logging.handlers
+import mmap
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from os.path import basename, dirname, join, exists
+
+from labels_files import find_labels_files
 
 # Example: 'data/experiments/llmq-gpt-4o-mini/llmr-gpt-3.5/docp-dt03'
 experiment_folder = os.getcwd() + '/experiment'
 
+# "csv" rewrites the labels CSV on every submit, "journal" appends one record per
+# submit to "<labels csv>.journal" and folds it back into the CSV periodically,
+# "sqlite" upserts into one shared database for every annotator and experiment
+annotation_storage = os.environ.get("ANNOTATION_STORAGE", "csv")
+# Compact the journal into the CSV once it holds this many records
+journal_compact_every = int(os.environ.get("JOURNAL_COMPACT_EVERY", "1000"))
+annotation_db_path = os.environ.get("ANNOTATION_DB", join(os.getcwd(), "annotations.sqlite3"))
+# Rescan the experiment tree every N seconds in a background thread instead of
+# checking directory mtimes on every rerun (0 turns the watcher off)
+catalog_poll_seconds = float(os.environ.get("EXPERIMENT_CATALOG_POLL", "0"))
+# Documents whose question slice stays cached for every session
+prefetch_max_entries = 16
+# Recently read document bodies kept for every session
+document_bodies_kept = 32
+# Bumped when the docs_out.offsets.json layout changes, older files are rebuilt
+document_offsets_version = 2
+# Opt-in timings of each phase of a rerun: ANNOTATE_PROFILE=1 (or ?profile=1) logs them
+# as JSON lines, "panel" also shows p50/p95 in the sidebar. ANNOTATE_CPROFILE=1
+# (or ?cprofile=1) keeps cProfile dumps of the slowest reruns next to the log.
+profile_log_path = os.environ.get("ANNOTATE_PROFILE_LOG", join(os.getcwd(), "profile", "reruns.jsonl"))
+profile_slowest_kept = 5
+# Set while the whole script runs. A fragment rerun runs against the globals of
+# the last full run, where this is back to False.
+profiled_run = {'active': False}
+# Work queue: ANNOTATION_QUEUE_TARGET=N hands each annotator the next document that
+# still needs labels until every question has N annotators (0 lets annotators pick
+# any doc_id). Leases on handed-out documents lapse after the given minutes.
+queue_target_labels = int(os.environ.get("ANNOTATION_QUEUE_TARGET", "0"))
+queue_lease_minutes = float(os.environ.get("ANNOTATION_QUEUE_LEASE_MINUTES", "30"))
+# Memory budget for loaded topics shared by every session, least recently used
+# topics are dropped first once it is exceeded
+topic_cache_mb = float(os.environ.get("TOPIC_CACHE_MB", "1024"))
+# Counts behind the progress dashboard, one entry per (experiment, topic, annotator)
+progress_summary_path = os.environ.get("PROGRESS_SUMMARY", join(os.getcwd(), "progress_summary.json"))
+
+annotation_columns = [
+    'doc_id', 'q_id', 'supposed_to_be_confusing', 'llm_confuse_label',
+    'human_confuse_label', 'human_defuse_label',
+    'question_category'
+]
+annotation_key = ['doc_id', 'q_id', 'supposed_to_be_confusing']
+
 # Load CSV files
-@st.cache_data
 def load_csv_data(data_dir):
-    doc_data = pd.read_csv(join(data_dir, "docs_out.csv"))  # Load document CSV
-    qrc_data = pd.read_csv(join(data_dir, "qrc_out.csv"))  # Load QRC CSV
+    return load_columnar_data(data_dir, *topic_stamps(data_dir))
+
+def topic_stamps(data_dir):
+    return file_stamp(join(data_dir, "docs_out.csv")), file_stamp(join(data_dir, "qrc_out.csv"))
+
+# One read-only copy per server process, shared by every session instead of a
+# pickled copy per rerun. The stamps are only there so an edited CSV gets a new entry.
+def load_columnar_data(data_dir, doc_stamp, qrc_stamp):
+    topic_cache = get_topic_cache()
+    key = (data_dir, doc_stamp, qrc_stamp)
+    with topic_cache['lock']:
+        if key in topic_cache['entries']:
+            topic_cache['entries'].move_to_end(key)
+            return topic_cache['entries'][key]['data']
+        # One load per topic at a time, sessions missing together wait for it
+        loading = topic_cache['loading'].setdefault(key, threading.Lock())
+
+    with loading:
+        with topic_cache['lock']:
+            if key in topic_cache['entries']:
+                topic_cache['entries'].move_to_end(key)
+                return topic_cache['entries'][key]['data']
+        try:
+            data = read_topic(data_dir)
+            # Only runs on a cache miss, the profiler tells hits from misses with this
+            get_profiler()['topic_loads'] += 1
+            cache_topic(topic_cache, key, data)
+        finally:
+            with topic_cache['lock']:
+                topic_cache['loading'].pop(key, None)
+    return data
+
+def cache_topic(topic_cache, key, data):
+    data_dir = key[0]
+    size = sum(int(frame.memory_usage(deep=True).sum()) for frame in data)
+    with topic_cache['lock']:
+        # An edited CSV replaces the topic's previous entry
+        for stale in [k for k in topic_cache['entries'] if k[0] == data_dir]:
+            topic_cache['bytes'] -= topic_cache['entries'].pop(stale)['size']
+        topic_cache['entries'][key] = {'data': data, 'size': size}
+        topic_cache['bytes'] += size
+        # Least recently used topics go first, the one just loaded always stays
+        while topic_cache['bytes'] > topic_cache_mb * 2**20 and len(topic_cache['entries']) > 1:
+            _, evicted = topic_cache['entries'].popitem(last=False)
+            topic_cache['bytes'] -= evicted['size']
+
+@st.cache_resource
+def get_topic_cache():
+    return {'lock': threading.Lock(), 'entries': OrderedDict(), 'bytes': 0, 'loading': {}}
+
+def read_topic(data_dir):
+    # Document bodies are read on demand by show_doc_contents, only keep the ids
+    doc_data = read_columnar(join(data_dir, "docs_out.csv"), columns=["doc_id"], prepare=compact_docs)  # Load document CSV
+    qrc_data = read_columnar(join(data_dir, "qrc_out.csv"), prepare=prepare_questions)  # Load QRC CSV
     return doc_data, qrc_data
 
+def compact_ids(ids):
+    # int32 when every id fits, anything else (text ids, huge numbers) as a category
+    if pd.api.types.is_integer_dtype(ids) and (ids.empty or (ids.min() >= -2**31 and ids.max() < 2**31)):
+        return ids.astype('int32')
+    return ids.astype('category')
+
+def compact_docs(doc_data):
+    return doc_data.assign(doc_id=compact_ids(doc_data['doc_id']))
+
+def prepare_questions(qrc_data):
+    # Compact ids, the repeated labels as categories and the LLM's Yes/No (the
+    # first line of `confusion`) extracted once instead of per rendered question
+    qrc_data = add_question_numbers(qrc_data)
+    qrc_data = qrc_data.astype({'is_confusing': 'bool', 'question_number': 'int32'})
+    qrc_data['doc_id'] = compact_ids(qrc_data['doc_id'])
+    qrc_data['q_id'] = compact_ids(qrc_data['q_id'])
+    qrc_data['llm_confuse_label'] = qrc_data['confusion'].str.split("\n").str[0].astype('category')
+    if 'is_defused' in qrc_data:
+        qrc_data['is_defused'] = qrc_data['is_defused'].astype('category')
+    return qrc_data
+
+def arrow_dtype(arrow_type):
+    # Dictionary columns come back as pandas categoricals, everything else stays
+    # Arrow-backed so the memory-mapped buffers are not copied
+    if pa.types.is_dictionary(arrow_type):
+        return None
+    return pd.ArrowDtype(arrow_type)
+
+def read_columnar(csv_path, columns=None, prepare=None):
+    # Converted once into an Arrow file next to the CSV and memory-mapped from
+    # then on; it is rebuilt when the CSV's (mtime, size) no longer matches.
+    # prepare() adds derived columns before the conversion is written.
+    arrow_path = csv_path[:-len(".csv")] + ".arrow"
+    stamp = json.dumps([file_stamp(csv_path), columns, prepare and prepare.__name__]).encode()
+    if exists(arrow_path):
+        try:
+            table = pa.ipc.open_file(pa.memory_map(arrow_path)).read_all()
+        except (OSError, pa.ArrowInvalid):
+            # Truncated or otherwise unreadable, convert again
+            table = None
+        if table is not None and (table.schema.metadata or {}).get(b"source_stamp") == stamp:
+            return table.to_pandas(types_mapper=arrow_dtype)
+
+    data = pd.read_csv(csv_path, usecols=columns)
+    if prepare is not None:
+        data = prepare(data)
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    table = table.replace_schema_metadata({b"source_stamp": stamp})
+    tmp_path = None
+    try:
+        # A temp file of our own, other processes may be converting the same CSV
+        fd, tmp_path = tempfile.mkstemp(prefix=basename(arrow_path) + ".", suffix=".tmp", dir=dirname(arrow_path))
+        os.close(fd)
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, arrow_path)
+    except OSError:
+        if tmp_path is not None and exists(tmp_path):
+            os.remove(tmp_path)
+        # Read-only experiment folder, serve the parsed CSV from memory
+        return table.to_pandas(types_mapper=arrow_dtype)
+    table = pa.ipc.open_file(pa.memory_map(arrow_path)).read_all()
+    return table.to_pandas(types_mapper=arrow_dtype)
+
 def init():
     # Set the layout to wide to make use of the full screen width
     st.set_page_config(layout="wide")
@@ -49,9 +229,10 @@ def sidebar_logic(cwd, experiment_folder):
     # Sidebar for selecting Experiment and Topic
     st.sidebar.header("Which Experiment/Topic to Work On")
     base_path = join(cwd, experiment_folder)
+    catalog = get_experiment_catalog(base_path)
     # Get the list of experiment folders 
     try:
-        exp_folders = [f for f in os.listdir(base_path) if os.path.isdir(join(base_path, f))]
+        exp_folders = list_subdirs(catalog, base_path)
     except FileNotFoundError:
         st.error("The base path does not exist.")
         exp_folders = []
@@ -65,13 +246,24 @@ def sidebar_logic(cwd, experiment_folder):
 
     # Get the list of topic folders
     try: 
-        topic_folders = [f for f in os.listdir(experiment_dir) if os.path.isdir(join(experiment_dir, f))]
+        topic_folders = list_subdirs(catalog, experiment_dir)
     except FileNotFoundError:
         st.error("The experiment path does not exist.")
         topic_folders = []
     # Dropdown for selecting topic folder
     if topic_folders: 
-        topic = st.sidebar.selectbox("Choose Topic:", topic_folders)
+        st.sidebar.caption(f"{len(topic_folders)} topics in {exp_name}")
+        labels = {topic: topic_label(catalog, join(experiment_dir, topic), topic) for topic in topic_folders}
+        # New counts change the labels and with them the widget, which then starts
+        # from the topic chosen last run instead of falling back to the first one
+        choice_key = f"topic_choice_{exp_name}"
+        chosen = st.session_state.get(choice_key)
+        topic = st.sidebar.selectbox(
+            "Choose Topic:", topic_folders,
+            index=topic_folders.index(chosen) if chosen in topic_folders else 0,
+            format_func=lambda topic: labels.get(topic, topic),
+        )
+        st.session_state[choice_key] = topic
         data_dir = join(experiment_dir, topic)
     else:
         st.error("No topics found in the experiment path")
@@ -79,6 +271,84 @@ def sidebar_logic(cwd, experiment_folder):
         
     return exp_name, data_dir
 
+@st.cache_resource
+def get_experiment_catalog(base_path):
+    # Shared by every session: directory listings keyed by the directory's mtime,
+    # and doc/question counts with the CSV stamps they were taken at, for every
+    # topic that has been loaded once or counted by the watcher
+    catalog = {'lock': threading.Lock(), 'listings': {}, 'topics': {}}
+    if catalog_poll_seconds > 0:
+        threading.Thread(target=poll_experiment_catalog, args=(catalog, base_path), daemon=True).start()
+    return catalog
+
+def list_subdirs(catalog, path, refresh=False):
+    listing = catalog['listings'].get(path)
+    # The watcher keeps listings fresh, no need to touch the file system
+    if listing is not None and catalog_poll_seconds > 0 and not refresh:
+        return listing[1]
+    # Adding or removing a folder changes its parent's mtime
+    mtime = os.stat(path).st_mtime_ns
+    if listing is None or listing[0] != mtime:
+        with os.scandir(path) as entries:
+            subdirs = [entry.name for entry in entries if entry.is_dir()]
+        listing = (mtime, subdirs)
+        with catalog['lock']:
+            catalog['listings'][path] = listing
+    return listing[1]
+
+def topic_label(catalog, data_dir, topic):
+    # Known once this topic was loaded by any session, or counted by the watcher
+    counts = catalog['topics'].get(data_dir)
+    if not counts:
+        return topic
+    return f"{topic} ({counts['docs']} docs, {counts['questions']} questions)"
+
+def record_topic_counts(catalog, data_dir, stamps, doc_data, qrc_data):
+    with catalog['lock']:
+        catalog['topics'][data_dir] = {'docs': doc_data['doc_id'].nunique(), 'questions': len(qrc_data), 'stamps': stamps}
+
+def poll_experiment_catalog(catalog, base_path):
+    while True:
+        time.sleep(catalog_poll_seconds)
+        try:
+            exp_folders = list_subdirs(catalog, base_path, refresh=True)
+        except OSError:
+            continue
+        for exp_name in exp_folders:
+            experiment_dir = join(base_path, exp_name)
+            try:
+                topic_folders = list_subdirs(catalog, experiment_dir, refresh=True)
+            except OSError:
+                continue
+            for topic in topic_folders:
+                data_dir = join(experiment_dir, topic)
+                try:
+                    # Taken before counting, an edit while we count is picked up next round
+                    stamps = topic_stamps(data_dir)
+                    counts = catalog['topics'].get(data_dir)
+                    if counts and counts['stamps'] == stamps:
+                        continue
+                    counts = {**count_topic(data_dir), 'stamps': stamps}
+                except (OSError, pa.ArrowInvalid):
+                    # Not a topic folder, or its CSVs are still being written
+                    continue
+                with catalog['lock']:
+                    catalog['topics'][data_dir] = counts
+
+def count_topic(data_dir):
+    # Parses only the id column and writes nothing, unlike read_topic this is
+    # cheap enough for topics nobody has opened yet
+    def read_ids(csv_path):
+        return pa.csv.read_csv(
+            csv_path,
+            parse_options=pa.csv.ParseOptions(newlines_in_values=True),
+            convert_options=pa.csv.ConvertOptions(include_columns=["doc_id"]),
+        )["doc_id"]
+    return {
+        'docs': pa.compute.count_distinct(read_ids(join(data_dir, "docs_out.csv"))).as_py(),
+        'questions': len(read_ids(join(data_dir, "qrc_out.csv"))),
+    }
+
 def check_username_csv_path(cwd, exp_name):
     # Check if annotator_name is in session_state
     if 'annotator_name' not in st.session_state:
@@ -94,7 +364,14 @@ def check_username_csv_path(cwd, exp_name):
     
     csv_filename = f"{annotator_name}_{exp_name}_labels.csv"
     csv_path = join(cwd, csv_filename)
-    check_and_create_annotations_csv(csv_path)
+    # The sqlite backend keys rows by annotator and experiment rather than by file
+    st.session_state.annotation_owner = (annotator_name, exp_name)
+    if annotation_storage == "sqlite":
+        # Labels saved before switching to sqlite carry over instead of starting empty
+        import_csv_annotations(st.session_state.annotation_owner, csv_path)
+        st.success(f"Annotations will be saved to: \"{annotation_db_path}\"")
+    else:
+        check_and_create_annotations_csv(csv_path)
     
     return csv_path
 
@@ -121,12 +398,7 @@ def check_and_create_annotations_csv(csv_path):
         else:
             if st.session_state.create_csv_choice == 'Yes':
                 # Create the DataFrame with the specified columns
-                columns = [
-                    'doc_id', 'q_id', 'supposed_to_be_confusing', 'llm_confuse_label',
-                    'human_confuse_label', 'human_defuse_label',
-                    'question_category'
-                ]
-                annotations_df = pd.DataFrame(columns=columns)
+                annotations_df = pd.DataFrame(columns=annotation_columns)
                 # Save the DataFrame as a CSV file
                 annotations_df.to_csv(csv_path, index=False)
                 st.success(f"{csv_path} created successfully.")
@@ -137,13 +409,13 @@ def check_and_create_annotations_csv(csv_path):
     else:
         st.success(f"Annotations will be saved to: \"{csv_path}\"")
 
-def select_doc_id_with_checkmarks(doc_data, qrc_data, annotations_df):
+def select_doc_id_with_checkmarks(doc_data, completion_index):
     doc_ids = doc_data["doc_id"].unique()
     
     doc_id_labels = []
     doc_id_mapping = {}
     for doc_id in doc_ids:
-        is_fully_annotated = check_if_document_fully_annotated(annotations_df, doc_id, qrc_data, return_bool=True)
+        is_fully_annotated = check_if_document_fully_annotated(completion_index, doc_id, return_bool=True)
         if is_fully_annotated:
             label = f"✅ {doc_id}"
         else:
@@ -151,10 +423,239 @@ def select_doc_id_with_checkmarks(doc_data, qrc_data, annotations_df):
         doc_id_labels.append(label)
         doc_id_mapping[label] = doc_id
 
-    selected_label = st.sidebar.selectbox("Choose doc_id:", doc_id_labels)
+    # Keyed so a search hit can select a document, see open_search_hit
+    selected_label = st.sidebar.selectbox("Choose doc_id:", doc_id_labels, key="doc_id_choice")
     doc_id = doc_id_mapping[selected_label]
     return doc_id
 
+def show_search(data_dir, qrc_data):
+    query = st.sidebar.text_input("Search documents, questions and responses:", key=f"search_{data_dir}")
+    if not query.strip():
+        return
+    try:
+        search_index = get_search_index(data_dir)
+    except sqlite3.Error as error:
+        # E.g. an SQLite built without FTS5
+        st.sidebar.warning(f"Search is not available for this topic: {error}")
+        return
+    documents, questions = search_topic(search_index, query)
+    if not documents and not questions:
+        st.sidebar.caption("No matches.")
+    for doc_id, snippet in documents:
+        st.sidebar.button(f"Document {doc_id}", key=f"search_hit_{doc_id}", on_click=open_search_hit, args=(qrc_data, doc_id, None))
+        st.sidebar.caption(snippet)
+    for doc_id, question_number, snippet in questions:
+        st.sidebar.button(f"Document {doc_id}, Question #{question_number}", key=f"search_hit_{doc_id}_{question_number}",
+                          on_click=open_search_hit, args=(qrc_data, doc_id, question_number))
+        st.sidebar.caption(snippet)
+
+def open_search_hit(qrc_data, doc_id, question_number):
+    # Runs before the doc_id selectbox is drawn, so setting its state selects the document
+    fully_annotated = check_if_document_fully_annotated(st.session_state.completion_index, doc_id, return_bool=True)
+    st.session_state.doc_id_choice = f"✅ {doc_id}" if fully_annotated else f"{doc_id}"
+    if question_number is not None:
+        numbers = select_questions(qrc_data, doc_id)['question_number'].to_numpy()
+        st.session_state[f"question_page_{doc_id}"] = int(np.flatnonzero(numbers == question_number)[0])
+
+def get_search_index(data_dir):
+    return open_search_index(data_dir, *topic_stamps(data_dir))
+
+# SQLite FTS5 tables in search.sqlite3 next to the CSVs, built once per topic and
+# rebuilt when either CSV's (mtime, size) no longer matches the stamp stored with it
+@st.cache_resource(max_entries=16)
+def open_search_index(data_dir, doc_stamp, qrc_stamp):
+    index_path = join(data_dir, "search.sqlite3")
+    stamp = json.dumps([doc_stamp, qrc_stamp])
+    if exists(index_path):
+        conn = sqlite3.connect(index_path, check_same_thread=False)
+        try:
+            if conn.execute("SELECT stamp FROM source").fetchone() == (stamp,):
+                return {'lock': threading.Lock(), 'conn': conn}
+        except sqlite3.DatabaseError:
+            pass
+        conn.close()
+
+    # Built in a temp file of our own, another server process may be building too
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix="search.sqlite3.", suffix=".tmp", dir=data_dir)
+        os.close(fd)
+    except OSError:
+        # Read-only experiment folder, keep the index in memory
+        tmp_path = None
+    conn = sqlite3.connect(tmp_path or ":memory:", check_same_thread=False)
+    try:
+        build_search_index(conn, data_dir, stamp)
+        if tmp_path is not None:
+            conn.close()
+            os.replace(tmp_path, index_path)
+            conn = sqlite3.connect(index_path, check_same_thread=False)
+    except BaseException:
+        conn.close()
+        raise
+    finally:
+        if tmp_path is not None and exists(tmp_path):
+            os.remove(tmp_path)
+    return {'lock': threading.Lock(), 'conn': conn}
+
+def build_search_index(conn, data_dir, stamp):
+    conn.execute("CREATE VIRTUAL TABLE documents USING fts5(doc_id UNINDEXED, document)")
+    conn.execute("CREATE VIRTUAL TABLE questions USING fts5(doc_id UNINDEXED, question_number UNINDEXED, question, response)")
+    # Bodies are not kept in memory by the app, stream them from the CSV
+    for chunk in pd.read_csv(join(data_dir, "docs_out.csv"), usecols=["doc_id", "document"], chunksize=10_000):
+        conn.executemany(
+            "INSERT INTO documents VALUES (?, ?)",
+            zip(chunk['doc_id'].tolist(), chunk['document'].fillna("").tolist()),
+        )
+    _, qrc_data = load_csv_data(data_dir)
+    conn.executemany(
+        "INSERT INTO questions VALUES (?, ?, ?, ?)",
+        zip(qrc_data['doc_id'].tolist(), qrc_data['question_number'].tolist(),
+            qrc_data['question'].fillna("").tolist(), qrc_data['response'].fillna("").tolist()),
+    )
+    # Merge the b-trees written during the build into one per table
+    conn.execute("INSERT INTO documents(documents) VALUES ('optimize')")
+    conn.execute("INSERT INTO questions(questions) VALUES ('optimize')")
+    conn.execute("CREATE TABLE source (stamp TEXT)")
+    conn.execute("INSERT INTO source VALUES (?)", [stamp])
+    conn.commit()
+
+def search_topic(search_index, query, limit=10):
+    # Every word has to match. Words are quoted so FTS5 operators in the query are
+    # searched for literally; no prefix matching, a short prefix hits most rows.
+    words = ['"' + word.replace('"', '""') + '"' for word in query.split()]
+    if not words:
+        return [], []
+    match = " ".join(words)
+    with search_index['lock']:
+        documents = search_index['conn'].execute(
+            "SELECT doc_id, snippet(documents, 1, '**', '**', '…', 16) FROM documents WHERE documents MATCH ? ORDER BY rank LIMIT ?",
+            [match, limit],
+        ).fetchall()
+        questions = search_index['conn'].execute(
+            "SELECT doc_id, question_number, snippet(questions, -1, '**', '**', '…', 16) FROM questions WHERE questions MATCH ? ORDER BY rank LIMIT ?",
+            [match, limit],
+        ).fetchall()
+    return documents, questions
+
+def select_doc_id_from_queue(cwd, exp_name, data_dir, doc_data, qrc_data, completion_index):
+    # Work queue mode: the sidebar shows the leased document instead of a free choice
+    annotator = st.session_state.annotator_name
+    assignment_key = f"assigned_doc_{data_dir}"
+    doc_id = st.session_state.get(assignment_key)
+    label_counts = team_label_counts(cwd, exp_name, data_dir, qrc_data)
+
+    skip = st.sidebar.button("Skip to another document")
+    done = doc_id is not None and check_if_document_fully_annotated(completion_index, doc_id, return_bool=True)
+    lapsed = doc_id is not None and not done and not skip and not renew_lease(data_dir, doc_id, annotator)
+    if doc_id is None or done or skip or lapsed:
+        doc_ids = list(doc_data["doc_id"].unique())
+        previous_doc_id = doc_id
+        doc_id = claim_next_document(data_dir, annotator, doc_ids, label_counts, completion_index, skip=doc_id if skip else None)
+        st.session_state[assignment_key] = doc_id
+        if lapsed and doc_id != previous_doc_id:
+            st.sidebar.info(f"Your reservation on document {previous_doc_id} expired and it went to someone else.")
+    # Submits only rerun a fragment, append_row_to_csv renews the lease from this
+    st.session_state.queue_lease = (data_dir, doc_id)
+
+    finished = sum(count >= queue_target_labels for count in label_counts.values())
+    st.sidebar.caption(f"{finished} of {doc_data['doc_id'].nunique()} documents have {queue_target_labels} labels per question")
+    if doc_id is None:
+        st.sidebar.success("No documents left for you in this topic.")
+        st.stop()
+    st.sidebar.write(f"Your document: {doc_id}")
+    st.sidebar.caption(f"Reserved for you for {queue_lease_minutes:g} minutes after your last action")
+    return doc_id
+
+def team_label_counts(cwd, exp_name, data_dir, qrc_data):
+    # doc_id -> fewest annotators on any of its questions, over everyone's labels
+    if annotation_storage == "sqlite":
+        db = get_annotation_db(annotation_db_path)
+        with db['lock']:
+            labels_stamp = db['conn'].execute(
+                "SELECT COUNT(*), MAX(updated_at) FROM annotations WHERE experiment = ?", [exp_name]
+            ).fetchone()
+    else:
+        base_path = join(cwd, experiment_folder)
+        exp_folders = list_subdirs(get_experiment_catalog(base_path), base_path)
+        labels_paths = list(find_labels_files(cwd, exp_name, exp_folders).values())
+        labels_stamp = tuple((path, annotations_stamp(path)) for path in labels_paths)
+    return doc_label_counts(exp_name, data_dir, file_stamp(join(data_dir, "qrc_out.csv")), labels_stamp, qrc_data)
+
+# Recomputed only when someone's labels or the topic's questions change;
+# _qrc_data is not hashed, qrc_stamp stands in for it
+@st.cache_resource(max_entries=64)
+def doc_label_counts(exp_name, data_dir, qrc_stamp, labels_stamp, _qrc_data):
+    if annotation_storage == "sqlite":
+        db = get_annotation_db(annotation_db_path)
+        with db['lock']:
+            rows = db['conn'].execute(
+                """
+                SELECT doc_id, q_id, supposed_to_be_confusing, COUNT(DISTINCT annotator)
+                FROM annotations WHERE experiment = ?
+                GROUP BY doc_id, q_id, supposed_to_be_confusing
+                """,
+                [exp_name],
+            ).fetchall()
+        question_counts = {(doc_id, q_id, bool(is_confusing)): count for doc_id, q_id, is_confusing, count in rows}
+    else:
+        question_counts = {}
+        for path, _ in labels_stamp:
+            for key in stored_label_rows(path):
+                question_counts[key] = question_counts.get(key, 0) + 1
+
+    keys = _qrc_data[['doc_id', 'q_id', 'is_confusing']]
+    counts = pd.Series(
+        [question_counts.get(key, 0) for key in zip(keys['doc_id'], keys['q_id'], keys['is_confusing'])],
+        index=keys.index,
+    )
+    return counts.groupby(keys['doc_id'].to_numpy()).min().to_dict()
+
+def claim_next_document(data_dir, annotator, doc_ids, label_counts, completion_index, skip=None):
+    # Lease the first document, in sidebar order, that still needs labels, that this
+    # annotator has not finished, and that is not already leased to enough others
+    db = get_annotation_db(annotation_db_path)
+    now = time.time()
+    with db['lock']:
+        conn = db['conn']
+        # Takes the write lock up front so two servers cannot hand out the same slot
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM leases WHERE expires_at < ?", [now])
+            conn.execute("DELETE FROM leases WHERE data_dir = ? AND annotator = ?", [data_dir, annotator])
+            leased = dict(conn.execute(
+                "SELECT doc_id, COUNT(*) FROM leases WHERE data_dir = ? GROUP BY doc_id", [data_dir]
+            ).fetchall())
+            doc_id = None
+            for candidate in doc_ids:
+                needed = queue_target_labels - label_counts.get(candidate, 0)
+                if (candidate != skip
+                        and needed > leased.get(plain_value(candidate), 0)
+                        and not check_if_document_fully_annotated(completion_index, candidate, return_bool=True)):
+                    doc_id = candidate
+                    break
+            if doc_id is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO leases (data_dir, doc_id, annotator, expires_at) VALUES (?, ?, ?, ?)",
+                    [data_dir, plain_value(doc_id), annotator, now + queue_lease_minutes * 60],
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return doc_id
+
+def renew_lease(data_dir, doc_id, annotator):
+    # Only extends a lease the annotator still holds. Once it has expired the slot
+    # may have been handed to someone else, so the caller has to claim again.
+    db = get_annotation_db(annotation_db_path)
+    now = time.time()
+    with db['lock'], db['conn']:
+        renewed = db['conn'].execute(
+            "UPDATE leases SET expires_at = ? WHERE data_dir = ? AND doc_id = ? AND annotator = ? AND expires_at >= ?",
+            [now + queue_lease_minutes * 60, data_dir, plain_value(doc_id), annotator, now],
+        ).rowcount
+    return renewed == 1
+
 def show_instructions():
     st.write("### Instructions:")
     st.write('''Make sure Experiment, Topic, and doc_id is correct. Read the "Document", take your time and understand what it's talking about''')
@@ -162,70 +663,517 @@ def show_instructions():
     st.write('''"Response" is LLM_r (gpt3.5)'s response after prompted with <Document, Question, "Read the document and answer the question">''')
     st.write('''Fill out the form for each question, then click "Submit", after finishing all questions for this document, move on to the next document by selecting "Choose doc_id" on the left sidebar''')
 
-def show_doc_contents(doc_data, doc_id):
-    st.session_state.document_content = doc_data[doc_data["doc_id"] == doc_id]["document"].values[0]
+def show_doc_contents(data_dir, doc_id):
+    st.session_state.document_content = read_document(join(data_dir, "docs_out.csv"), doc_id)
+    if st.session_state.document_content is None:
+        st.error(f"Document {doc_id} was not found in docs_out.csv.")
+        return
     # Display Document Content
     if st.session_state.document_content:
         st.write(f"### Document: {doc_id}")
         st.write(st.session_state.document_content)
 
+def read_document(doc_path, doc_id):
+    stamp = file_stamp(doc_path)
+    return read_document_body(get_document_bodies(), load_document_offsets(doc_path, stamp), (doc_path, stamp, str(doc_id)))
+
+# Recently viewed bodies, shared by every session. A plain LRU under a lock rather
+# than st.cache_resource, so prefetch workers (no script run context) can fill it too.
+@st.cache_resource
+def get_document_bodies():
+    return {'lock': threading.Lock(), 'bodies': OrderedDict()}
+
+def read_document_body(document_bodies, document_offsets, key):
+    # key is (doc_path, stamp, doc_id), the stamp retires bodies of an edited CSV
+    with document_bodies['lock']:
+        if key in document_bodies['bodies']:
+            document_bodies['bodies'].move_to_end(key)
+            return document_bodies['bodies'][key]
+    doc_id = key[2]
+    if doc_id not in document_offsets['offsets']:
+        return None
+    start, end = document_offsets['offsets'][doc_id]
+    fields = parse_record(document_offsets['mmap'][start:end])
+    body = fields[document_offsets['document_column']]
+    with document_bodies['lock']:
+        document_bodies['bodies'][key] = body
+        while len(document_bodies['bodies']) > document_bodies_kept:
+            document_bodies['bodies'].popitem(last=False)
+    return body
+
+# Each entry holds an mmap of docs_out.csv, keep the most recently used topics only
+@st.cache_resource(max_entries=16)
+def load_document_offsets(doc_path, stamp):
+    # doc_id -> [start, end) byte span of its record in docs_out.csv, persisted
+    # as docs_out.offsets.json and rebuilt when the CSV's (mtime, size) changes
+    offsets_path = doc_path[:-len(".csv")] + ".offsets.json"
+    document_offsets = None
+    if exists(offsets_path):
+        with open(offsets_path) as f:
+            document_offsets = json.load(f)
+        if document_offsets['source_stamp'] != list(stamp) or document_offsets.get('version') != document_offsets_version:
+            document_offsets = None
+
+    if document_offsets is None:
+        document_offsets = build_document_offsets(doc_path)
+        document_offsets['source_stamp'] = list(stamp)
+        document_offsets['version'] = document_offsets_version
+        try:
+            with atomic_write(offsets_path) as f:
+                json.dump(document_offsets, f)
+        except OSError:
+            # Read-only experiment folder, keep the index in memory only
+            pass
+
+    with open(doc_path, "rb") as f:
+        document_offsets['mmap'] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return document_offsets
+
+def build_document_offsets(doc_path):
+    spans = []
+    header = None
+    with open(doc_path, "rb") as f:
+        record = []
+        record_start = 0
+        position = 0
+        quotes = 0
+        for line in f:
+            record.append(line)
+            position += len(line)
+            quotes += line.count(b'"')
+            # A newline inside a quoted field leaves an odd number of quotes so far
+            if quotes % 2:
+                continue
+            fields = parse_record(b"".join(record))
+            if header is None:
+                header = fields
+            elif fields:
+                spans.append((fields[header.index("doc_id")], [record_start, position]))
+            record = []
+            record_start = position
+            quotes = 0
+
+    # Keyed by str() of the doc_id the app shows ("007" is 7 there), so the raw
+    # ids are parsed and compacted the way read_topic does it
+    raw_ids = io.StringIO()
+    csv.writer(raw_ids).writerows([["doc_id"]] + [[doc_id] for doc_id, _ in spans])
+    raw_ids.seek(0)
+    doc_ids = compact_ids(pd.read_csv(raw_ids)['doc_id']).tolist()
+    offsets = {}
+    for doc_id, (_, span) in zip(doc_ids, spans):
+        offsets.setdefault(str(doc_id), span)
+    return {
+        'document_column': header.index("document"),
+        'offsets': offsets,
+    }
+
+@contextmanager
+def atomic_write(path, mode="w"):
+    # Written to a temp file of our own next to path and renamed over it, other
+    # sessions or server processes may be writing the same file at the same time
+    fd, tmp_path = tempfile.mkstemp(prefix=basename(path) + ".", suffix=".tmp", dir=dirname(path) or ".")
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if exists(tmp_path):
+            os.remove(tmp_path)
+
+def parse_record(raw):
+    return next(csv.reader(io.StringIO(raw.decode("utf-8-sig"), newline="")), [])
+
 # Function to append a row to the CSV file
-def append_row_to_csv(csv_path, row_data, qrc_data):
-    annotations_df = pd.read_csv(csv_path)
-    existing_entry_index = annotations_df[
-        (annotations_df['doc_id'] == row_data['doc_id']) &
-        (annotations_df['q_id'] == row_data['q_id']) & 
-        (annotations_df['supposed_to_be_confusing'] == row_data['supposed_to_be_confusing'])
-    ].index
-    
-    if not existing_entry_index.empty:
-        # Overwrite the existing entry
-        # Create a DataFrame from row_data with the same index
-        new_row_df = pd.DataFrame([row_data], columns=annotations_df.columns, index=existing_entry_index)
-        annotations_df.loc[existing_entry_index] = new_row_df
-        annotations_df.to_csv(csv_path, index=False)
-        st.info(f"Overwritten previous annotation.")
+def append_row_to_csv(csv_path, row_data):
+    with profile_phase("append_row_to_csv"):
+        annotation_store = get_annotation_store(csv_path)
+        overwritten = save_to_annotation_store(annotation_store, csv_path, row_data)
+        completion_index = st.session_state.completion_index
+        mark_question_annotated(completion_index, row_data)
+        # Still in sync unless another tab of this annotator saved in the meantime
+        if completion_index['version'] == annotation_store['version'] - 1:
+            completion_index['version'] = annotation_store['version']
+
+        if queue_target_labels > 0 and not renew_lease(*st.session_state.queue_lease, st.session_state.annotator_name):
+            # The label is saved, but the lease lapsed: rerun the whole script so
+            # select_doc_id_from_queue claims a document again
+            st.rerun()
+
+        if not overwritten and check_if_document_fully_annotated(completion_index, row_data['doc_id'], return_bool=True):
+            # Submits only rerun their question's fragment, rerun the whole script
+            # once so the sidebar checkmark for this document shows up
+            st.session_state.flash_message = f"All questions for Document ID {row_data['doc_id']} have been annotated."
+            st.rerun()
+
+        if overwritten:
+            st.info(f"Overwritten previous annotation.")
+        else:
+            st.success(f"Annotation submitted.")
+        check_if_document_fully_annotated(completion_index, row_data['doc_id'])
+
+@st.cache_resource
+def get_annotation_store(csv_path):
+    # One in-memory copy of an annotator's labels per server process, shared by all
+    # their tabs: (doc_id, q_id, supposed_to_be_confusing) -> row, in file order.
+    # 'version' goes up on every change so completion indexes know to rebuild.
+    # 'columns' is the labels CSV header, rows are written back in its order.
+    annotation_store = {
+        'lock': threading.RLock(), 'rows': {}, 'columns': annotation_columns,
+        'stamp': None, 'version': 0, 'journal_records': 0,
+    }
+    get_annotation_stores()[csv_path] = annotation_store
+    return annotation_store
+
+@st.cache_resource
+def get_annotation_stores():
+    # csv_path -> store, for the annotators who have opened the app in this process
+    return {}
+
+def annotation_rows_by_key(annotations_df):
+    return {
+        (row['doc_id'], row['q_id'], row['supposed_to_be_confusing']): row
+        for row in annotations_df.to_dict('records')
+    }
+
+def sync_annotation_store(annotation_store, csv_path):
+    # Reload only when the labels changed on disk behind our back
+    stamp = annotations_stamp(csv_path)
+    with annotation_store['lock']:
+        if annotation_store['stamp'] == stamp:
+            return
+        annotations_df = load_annotations(csv_path)
+        annotation_store['rows'] = annotation_rows_by_key(annotations_df)
+        annotation_store['columns'] = list(annotations_df.columns)
+        annotation_store['stamp'] = annotations_stamp(csv_path)
+        annotation_store['version'] += 1
+        annotation_store['journal_records'] = 0
+
+def save_to_annotation_store(annotation_store, csv_path, row_data):
+    # Update the store in place and write through to disk, returns whether an
+    # earlier annotation of the same question was overwritten
+    key = (row_data['doc_id'], row_data['q_id'], row_data['supposed_to_be_confusing'])
+    row = {column: plain_value(row_data[column]) for column in annotation_columns}
+    with annotation_store['lock']:
+        sync_annotation_store(annotation_store, csv_path)
+        overwritten = key in annotation_store['rows']
+        annotation_store['rows'][key] = row
+        if annotation_storage == "journal":
+            append_row_to_journal(csv_path, row)
+            annotation_store['journal_records'] += 1
+            if annotation_store['journal_records'] >= journal_compact_every:
+                compact_journal(csv_path)
+                annotation_store['journal_records'] = 0
+        elif annotation_storage == "sqlite":
+            upsert_row(st.session_state.annotation_owner, row)
+        elif overwritten:
+            # Overwrite in place, keeping the row where it was
+            write_annotations_csv(csv_path, annotation_store['columns'], annotation_store['rows'].values())
+        else:
+            append_annotations_csv_row(csv_path, annotation_store['columns'], row)
+        annotation_store['stamp'] = annotations_stamp(csv_path)
+        annotation_store['version'] += 1
+    return overwritten
+
+def write_annotations_csv(csv_path, columns, rows):
+    # Columns we do not know about are kept, blank for rows saved by the app
+    with atomic_write(csv_path) as f:
+        pd.DataFrame(list(rows), columns=columns).to_csv(f, index=False)
+
+def append_annotations_csv_row(csv_path, columns, row):
+    with open(csv_path, "a", newline="") as f:
+        csv.writer(f, lineterminator="\n").writerow([row.get(column, "") for column in columns])
+
+def journal_path(csv_path):
+    return csv_path + ".journal"
+
+def append_row_to_journal(csv_path, row_data):
+    # One JSON line per submit, on disk before we report success
+    record = json.dumps({column: row_data[column] for column in annotation_columns}, default=plain_value)
+    with open(journal_path(csv_path), "a+b") as f:
+        # After a crash mid-write the last line is torn; start on a fresh line so
+        # this record is not glued onto it and dropped with it by read_journal
+        if f.seek(0, os.SEEK_END) > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                record = "\n" + record
+        f.write((record + "\n").encode())
+        f.flush()
+        os.fsync(f.fileno())
+
+def read_journal(path):
+    records = []
+    if exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # A torn last line from a crash mid-write, the submit never succeeded
+                    continue
+    return records
+
+def plain_value(value):
+    # numpy scalars from the topic data are not JSON/SQLite friendly
+    return value.item() if hasattr(value, 'item') else value
+
+def load_annotations(csv_path):
+    if annotation_storage == "sqlite":
+        return read_sqlite_annotations(st.session_state.annotation_owner)
+    return read_annotation_files(csv_path)
+
+def read_annotation_files(csv_path):
+    # The labels CSV plus whatever the journal has not folded into it yet
+    if exists(csv_path):
+        annotations_df = pd.read_csv(csv_path)
     else:
-        # Append the new annotation
-        new_row = pd.DataFrame([row_data], columns=annotations_df.columns)
-        annotations_df = pd.concat([annotations_df, new_row], ignore_index=True)
-        annotations_df.to_csv(csv_path, index=False)
-        st.success(f"Annotation submitted.")
-        
-    check_if_document_fully_annotated(annotations_df, row_data['doc_id'], qrc_data)
+        annotations_df = pd.DataFrame(columns=annotation_columns)
 
-def check_if_document_fully_annotated(annotations_df, doc_id, qrc_data, return_bool=False):
-    selected_qrc = qrc_data[(qrc_data["doc_id"] == doc_id)]
-    selected_qrc = selected_qrc.sample(frac=1, random_state=42).reset_index(drop=True)
-    
-    question_mapping = {}
-    for index, row in selected_qrc.iterrows():
-        question_mapping[(row['q_id'], row['is_confusing'])] = index + 1
-
-    # Create a set of unique identifiers for annotated questions
-    annotated_questions = set(
-        zip(
-            annotations_df[annotations_df['doc_id'] == doc_id]['q_id'],
-            annotations_df[annotations_df['doc_id'] == doc_id]['supposed_to_be_confusing']
+    # Records from an interrupted compaction come before the live journal
+    records = read_journal(journal_path(csv_path) + ".compacting") + read_journal(journal_path(csv_path))
+    if not records:
+        return annotations_df
+
+    journal_df = pd.DataFrame(records, columns=annotation_columns)
+    annotations_df = pd.concat([annotations_df, journal_df], ignore_index=True)
+    # Last write wins for the same question
+    annotations_df = annotations_df.drop_duplicates(subset=annotation_key, keep='last').reset_index(drop=True)
+    if len(records) >= journal_compact_every and exists(csv_path):
+        compact_journal(csv_path)
+    return annotations_df
+
+def compact_journal(csv_path):
+    # Fold the journal into the labels CSV in the format check_and_create_annotations_csv creates.
+    # The journal is moved aside first so submits from other tabs go to a fresh one.
+    journal = journal_path(csv_path)
+    compacting = journal + ".compacting"
+    if exists(journal) and not exists(compacting):
+        try:
+            os.replace(journal, compacting)
+        except FileNotFoundError:
+            # Another process moved it aside first
+            pass
+
+    annotations_df = pd.read_csv(csv_path)
+    records = read_journal(compacting)
+    if records:
+        annotations_df = pd.concat([annotations_df, pd.DataFrame(records, columns=annotation_columns)], ignore_index=True)
+        annotations_df = annotations_df.drop_duplicates(subset=annotation_key, keep='last')
+
+    with atomic_write(csv_path) as f:
+        annotations_df.to_csv(f, index=False)
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        os.remove(compacting)
+    except FileNotFoundError:
+        # Nothing was moved aside, or another process already finished
+        pass
+
+@st.cache_resource
+def get_annotation_db(db_path):
+    # One connection per server process shared by every session. WAL lets readers
+    # in other processes (exports, admin merges) run while we write.
+    conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # With WAL, NORMAL only risks the last commits on power loss, never corruption
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS annotations (
+            annotator TEXT NOT NULL,
+            experiment TEXT NOT NULL,
+            doc_id,
+            q_id,
+            supposed_to_be_confusing,
+            llm_confuse_label TEXT,
+            human_confuse_label TEXT,
+            human_defuse_label TEXT,
+            question_category TEXT,
+            updated_at REAL NOT NULL,
+            UNIQUE (annotator, experiment, doc_id, q_id, supposed_to_be_confusing)
         )
+        """
     )
-    # Create a set of unique identifiers for all questions in the selected_qrc
-    all_questions = set(
-        zip(
-            selected_qrc['q_id'],
-            selected_qrc['is_confusing']
+    # Work queue leases, see claim_next_document
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leases (
+            data_dir TEXT NOT NULL,
+            doc_id,
+            annotator TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (data_dir, doc_id, annotator)
         )
+        """
     )
-    remaining_questions = all_questions - annotated_questions
-    if not remaining_questions:
+    conn.commit()
+    return {'conn': conn, 'lock': threading.Lock()}
+
+def upsert_row(annotation_owner, row_data):
+    upsert_rows(annotation_owner, [row_data])
+
+def upsert_rows(annotation_owner, rows):
+    annotator, experiment = annotation_owner
+    updated_at = time.time()
+    values = [
+        [annotator, experiment, *[plain_value(row_data[column]) for column in annotation_columns], updated_at]
+        for row_data in rows
+    ]
+    db = get_annotation_db(annotation_db_path)
+    with db['lock'], db['conn']:
+        db['conn'].executemany(
+            """
+            INSERT INTO annotations (annotator, experiment, doc_id, q_id, supposed_to_be_confusing,
+                                     llm_confuse_label, human_confuse_label, human_defuse_label,
+                                     question_category, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (annotator, experiment, doc_id, q_id, supposed_to_be_confusing) DO UPDATE SET
+                llm_confuse_label = excluded.llm_confuse_label,
+                human_confuse_label = excluded.human_confuse_label,
+                human_defuse_label = excluded.human_defuse_label,
+                question_category = excluded.question_category,
+                updated_at = excluded.updated_at
+            """,
+            values,
+        )
+
+def import_csv_annotations(annotation_owner, csv_path):
+    # Only for an annotator/experiment the database has never seen, so later
+    # edits in the database are not overwritten by the old CSV
+    if not exists(csv_path) and not exists(journal_path(csv_path)):
+        return
+    db = get_annotation_db(annotation_db_path)
+    with db['lock']:
+        known = db['conn'].execute(
+            "SELECT 1 FROM annotations WHERE annotator = ? AND experiment = ? LIMIT 1", list(annotation_owner)
+        ).fetchone()
+    if known:
+        return
+    annotations_df = read_annotation_files(csv_path)
+    # Empty question_category cells are NaN, SQLite should get NULL
+    annotations_df = annotations_df.astype(object).where(annotations_df.notna(), None)
+    upsert_rows(annotation_owner, annotations_df.to_dict('records'))
+
+def read_sqlite_annotations(annotation_owner):
+    db = get_annotation_db(annotation_db_path)
+    with db['lock']:
+        annotations_df = pd.read_sql_query(
+            f"SELECT {', '.join(annotation_columns)} FROM annotations WHERE annotator = ? AND experiment = ? ORDER BY rowid",
+            db['conn'],
+            params=list(annotation_owner),
+        )
+    # SQLite hands booleans back as 0/1
+    annotations_df['supposed_to_be_confusing'] = annotations_df['supposed_to_be_confusing'].astype(bool)
+    return annotations_df
+
+def export_path(csv_path):
+    # Next to, not over, the labels CSV: that may still hold labels from before sqlite
+    return csv_path[:-len(".csv")] + ".export.csv"
+
+def export_sqlite_annotations(annotation_owner, csv_path):
+    # Same columns as the CSV check_and_create_annotations_csv creates
+    annotations_df = read_sqlite_annotations(annotation_owner)
+    annotations_df.to_csv(export_path(csv_path) + ".tmp", index=False)
+    os.replace(export_path(csv_path) + ".tmp", export_path(csv_path))
+
+def file_stamp(path):
+    # (mtime, size) is enough to notice the labels CSV was written by someone else
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+def annotations_stamp(csv_path):
+    if annotation_storage == "sqlite":
+        db = get_annotation_db(annotation_db_path)
+        with db['lock']:
+            return db['conn'].execute(
+                "SELECT COUNT(*), MAX(updated_at) FROM annotations WHERE annotator = ? AND experiment = ?",
+                list(st.session_state.annotation_owner),
+            ).fetchone()
+    return tuple(file_stamp(path) if exists(path) else None for path in (csv_path, journal_path(csv_path)))
+
+def question_numbers(qrc_data):
+    # The "Question #N" annotators see is the row's position after
+    # selected_qrc.sample(frac=1, random_state=42) within its document.
+    # sample() on n rows is RandomState(42).permutation(n), so every document
+    # with n questions shares one permutation; invert it once per group size.
+    positions = qrc_data.groupby("doc_id", sort=False).cumcount().to_numpy()
+    sizes = qrc_data.groupby("doc_id", sort=False)["doc_id"].transform("size").to_numpy()
+    numbers = np.zeros(len(qrc_data), dtype=np.int64)
+    for n in np.unique(sizes):
+        permutation = np.random.RandomState(42).permutation(n)
+        inverse = np.empty(n, dtype=np.int64)
+        inverse[permutation] = np.arange(1, n + 1)
+        in_group = sizes == n
+        numbers[in_group] = inverse[positions[in_group]]
+    return pd.Series(numbers, index=qrc_data.index)
+
+def add_question_numbers(qrc_data):
+    # Persisted with the topic so the form and the completion index share one numbering,
+    # rows are stored in the order they are shown
+    qrc_data = qrc_data.assign(question_number=question_numbers(qrc_data))
+    return qrc_data.sort_values(["doc_id", "question_number"], kind="stable").reset_index(drop=True)
+
+def build_completion_index(qrc_data, annotated_questions):
+    # One pass over the whole topic: doc_id -> total / annotated / remaining question numbers
+    keys = qrc_data[['doc_id', 'q_id', 'is_confusing', 'question_number']].copy()
+    keys = keys.drop_duplicates(subset=['doc_id', 'q_id', 'is_confusing'], keep='last')
+
+    keys['annotated'] = pd.MultiIndex.from_frame(keys[['doc_id', 'q_id', 'is_confusing']]).isin(annotated_questions)
+
+    grouped = keys.groupby('doc_id', sort=False)
+    table = pd.DataFrame({
+        'total': grouped.size(),
+        'annotated': grouped['annotated'].sum(),
+    })
+    remaining = keys[~keys['annotated']].groupby('doc_id', sort=False)['question_number'].agg(lambda numbers: sorted(numbers.tolist()))
+    table['remaining'] = remaining.reindex(table.index)
+    table['remaining'] = [numbers if isinstance(numbers, list) else [] for numbers in table['remaining']]
+
+    question_lookup = dict(zip(zip(keys['doc_id'], keys['q_id'], keys['is_confusing']), keys['question_number'].tolist()))
+    return {'table': table, 'question_numbers': question_lookup}
+
+def get_completion_index(data_dir, csv_path, qrc_data, annotation_store):
+    # Reuse the index across reruns until the topic or the annotations change
+    completion_index = st.session_state.get('completion_index')
+    if (completion_index is None
+            or completion_index['source'] != (data_dir, csv_path)
+            or completion_index['store'] is not annotation_store
+            or completion_index['version'] != annotation_store['version']):
+        with annotation_store['lock']:
+            annotated_questions = set(annotation_store['rows'])
+            version = annotation_store['version']
+        completion_index = build_completion_index(qrc_data, annotated_questions)
+        completion_index['source'] = (data_dir, csv_path)
+        completion_index['store'] = annotation_store
+        completion_index['version'] = version
+        st.session_state.completion_index = completion_index
+    return completion_index
+
+def mark_question_annotated(completion_index, row_data):
+    key = (row_data['doc_id'], row_data['q_id'], row_data['supposed_to_be_confusing'])
+    question_number = completion_index['question_numbers'].get(key)
+    table = completion_index['table']
+    if question_number is None or row_data['doc_id'] not in table.index:
+        return False
+    remaining = table.at[row_data['doc_id'], 'remaining']
+    if question_number in remaining:
+        remaining.remove(question_number)
+        table.at[row_data['doc_id'], 'annotated'] += 1
+        return True
+    return False
+
+def check_if_document_fully_annotated(completion_index, doc_id, return_bool=False):
+    table = completion_index['table']
+    # Documents without any questions count as done
+    remaining_question_indexes = table.at[doc_id, 'remaining'] if doc_id in table.index else []
+    if not remaining_question_indexes:
         if return_bool:
             return True
         st.success(f"All questions for Document ID {doc_id} have been annotated.")
     else:
         if return_bool:
             return False
-        remaining_question_indexes = [question_mapping[question] for question in remaining_questions]
-        st.info(f"Question # not yet annotated: {sorted(remaining_question_indexes)} for Document {doc_id}")
+        st.info(f"Question # not yet annotated: {remaining_question_indexes} for Document {doc_id}")
 
 # OLD VERSION WHERE I JUST SHOW EVERYTHING
 # def show_question_contents_and_annotation_form(qrc_data, doc_id, csv_path, annotations_df):
@@ -305,154 +1253,572 @@ def check_if_document_fully_annotated(annotations_df, doc_id, qrc_data, return_b
 
 
 
-# NEED TO CLICK SUBMIT TWICE
-def show_question_contents_and_annotation_form(qrc_data, doc_id, csv_path, annotations_df):
-    # Select all questions associated with this document
-    selected_qrc = qrc_data[qrc_data["doc_id"] == doc_id]
-    # Shuffle
-    selected_qrc = selected_qrc.sample(frac=1, random_state=42).reset_index(drop=True)
+def show_question_contents_and_annotation_form(qrc_data, doc_id, csv_path):
+    # Select all questions associated with this document, already stored in "Question #" order
+    selected_qrc = select_questions(qrc_data, doc_id)
 
     if not selected_qrc.empty:
         for index, row in selected_qrc.iterrows():
-            q_id = row['q_id']
-            supposed_to_be_confusing = row['is_confusing']
-            st.write(f"**Question #{index + 1}**:")
-            llm_confuse_label = row['confusion'].split("\n")[0]
-
-            # Display the Question
-            st.text_area("Question:", value=row['question'], key=f"question_{index}")
-
-            # Define keys for session state
-            human_confuse_label_key = f"human_confuse_label_{index}"
-            form1_submitted_key = f"form1_submitted_{index}"
-
-            # Initialize form1_submitted in session_state if not set
-            if form1_submitted_key not in st.session_state:
-                st.session_state[form1_submitted_key] = False
-
-            if not st.session_state[form1_submitted_key]:
-                # Form 1: Ask "Is this question confusing?"
-                with st.form(key=f'form1_{index}'):
-                    human_confuse_label_options = ["Did not select", "Yes", "No"]
-                    human_confuse_label = st.radio(
-                        "Is this question confusing? (Please select Yes or No)",
-                        human_confuse_label_options,
-                        key=human_confuse_label_key,
-                    )
-                    submit_button = st.form_submit_button(label='Submit')
-                    if submit_button:
-                        if human_confuse_label == "Did not select":
-                            st.info("Please select 'Yes' or 'No' before submitting.")
-                        else:
-                            st.session_state[form1_submitted_key] = True
-                            if human_confuse_label == "No":
-                                # Save data immediately
-                                row_data = {
-                                    'doc_id': doc_id,
-                                    'q_id': q_id,
-                                    'supposed_to_be_confusing': supposed_to_be_confusing,
-                                    'llm_confuse_label': llm_confuse_label,
-                                    'human_confuse_label': human_confuse_label,
-                                    'human_defuse_label': "Did not select",
-                                    'question_category': ""
-                                }
-                                append_row_to_csv(csv_path, row_data, qrc_data)
-                            elif human_confuse_label == "Yes":
-                                # Proceed to next form
-                                pass
-            else:
-                human_confuse_label = "Yes"
-                # Since form1 was submitted and human_confuse_label is "Yes", proceed to next form
-                st.text_area("Response:", value=row['response'], key=f"response_{index}")
-                # Form 2: Additional annotations
-                with st.form(key=f'form2_{index}', clear_on_submit=True):
-                    st.write("##### Since you think the question is confusing:")
-                    question_category_options = [
-                        'False Premise/Assumption',
-                        'Not Mentioned/Relevant',
-                        'Ambiguous',
-                        'Other'
-                    ]
-                    question_category = st.multiselect(
-                        "Select the category of confusion (usually 1 category is enough):",
-                        options=question_category_options,
-                        key=f"question_category_{index}"
-                    )
-                    # If 'Other' is selected, display a text input for the custom category
-                    other_category = ""
-                    if 'Other' in question_category:
-                        other_category = st.text_input(
-                            "Please specify the other category:",
-                            key=f"other_category_{index}"
-                        )
-                    human_defuse_label_options = ["Did not select", "Yes", "No"]
-                    human_defuse_label = st.radio(
-                        "Did the LLM's response defuse the confusion?",
-                        human_defuse_label_options,
-                        key=f"human_defuse_label_{index}",
-                    )
-                    submit_button = st.form_submit_button(label='Submit')
-                    if submit_button:
-                        if human_defuse_label == "Did not select":
-                            st.info("Please select 'Yes' or 'No' before submitting.")
-                        else:
-                            if 'Other' in question_category:
-                                if other_category:
-                                    question_category.remove('Other')  # Remove 'Other' placeholder
-                                    question_category.append(other_category)  # Add the custom category
-                                else:
-                                    st.error("Please specify the 'Other' category.")
-                                    st.stop()
-
-                            question_category_str = ', '.join(question_category) if question_category else "Did not select"
-
-                            # When the submit button is clicked, append the data to the CSV
-                            row_data = {
-                                'doc_id': doc_id,
-                                'q_id': q_id,
-                                'supposed_to_be_confusing': supposed_to_be_confusing,
-                                'llm_confuse_label': llm_confuse_label,
-                                'human_confuse_label': human_confuse_label,
-                                'human_defuse_label': human_defuse_label,
-                                'question_category': question_category_str
-                            }
-                            append_row_to_csv(csv_path, row_data, qrc_data)
+            show_question_and_annotation_form(row, index, doc_id, csv_path)
             st.write("---")  # Add a separator between questions
     else:
         st.write("No data found for the selected document and confusion status.")
 
-######## Script Below ###########
+# A fragment, so a submit reruns only this question instead of the whole script
+@st.fragment
+def show_question_and_annotation_form(row, index, doc_id, csv_path):
+    with profile_rerun("fragment_rerun"):
+        show_annotation_form(row, index, doc_id, csv_path)
 
-cwd = init() 
+def show_annotation_form(row, index, doc_id, csv_path):
+    q_id = row['q_id']
+    supposed_to_be_confusing = row['is_confusing']
+    st.write(f"**Question #{row['question_number']}**:")
+    llm_confuse_label = row['llm_confuse_label']
 
-# Sidebar logic to select experiment and topic
-exp_name, data_dir = sidebar_logic(cwd, experiment_folder)
+    # Display the Question
+    st.text_area("Question:", value=row['question'], key=f"question_{index}")
 
-# Now we can get the CSV path since we have exp_name
-csv_path = check_username_csv_path(cwd, exp_name)
+    # Define keys for session state
+    human_confuse_label_key = f"human_confuse_label_{index}"
+    form1_submitted_key = f"form1_submitted_{index}"
 
-# Load data
-doc_data, qrc_data = load_csv_data(data_dir)
+    # Initialize form1_submitted in session_state if not set
+    if form1_submitted_key not in st.session_state:
+        st.session_state[form1_submitted_key] = False
 
-# Load annotations DataFrame
-if exists(csv_path):
-    annotations_df = pd.read_csv(csv_path)
-else:
-    columns = [
-        'doc_id', 'q_id', 'supposed_to_be_confusing', 'llm_confuse_label',
-        'human_confuse_label', 'human_defuse_label',
-        'question_category'
+    if not st.session_state[form1_submitted_key]:
+        # Form 1: Ask "Is this question confusing?"
+        with st.form(key=f'form1_{index}'):
+            human_confuse_label_options = ["Did not select", "Yes", "No"]
+            human_confuse_label = st.radio(
+                "Is this question confusing? (Please select Yes or No)",
+                human_confuse_label_options,
+                key=human_confuse_label_key,
+            )
+            submit_button = st.form_submit_button(label='Submit', on_click=confirm_confusing, args=(human_confuse_label_key, form1_submitted_key))
+            if submit_button:
+                if human_confuse_label == "Did not select":
+                    st.info("Please select 'Yes' or 'No' before submitting.")
+                else:
+                    st.session_state[form1_submitted_key] = True
+                    if human_confuse_label == "No":
+                        # Save data immediately
+                        row_data = {
+                            'doc_id': doc_id,
+                            'q_id': q_id,
+                            'supposed_to_be_confusing': supposed_to_be_confusing,
+                            'llm_confuse_label': llm_confuse_label,
+                            'human_confuse_label': human_confuse_label,
+                            'human_defuse_label': "Did not select",
+                            'question_category': ""
+                        }
+                        append_row_to_csv(csv_path, row_data)
+                    elif human_confuse_label == "Yes":
+                        # Proceed to next form (confirm_confusing already switched to it)
+                        pass
+    else:
+        human_confuse_label = "Yes"
+        # Since form1 was submitted and human_confuse_label is "Yes", proceed to next form
+        st.text_area("Response:", value=row['response'], key=f"response_{index}")
+        # Form 2: Additional annotations
+        with st.form(key=f'form2_{index}', clear_on_submit=True):
+            st.write("##### Since you think the question is confusing:")
+            question_category_options = [
+                'False Premise/Assumption',
+                'Not Mentioned/Relevant',
+                'Ambiguous',
+                'Other'
+            ]
+            question_category = st.multiselect(
+                "Select the category of confusion (usually 1 category is enough):",
+                options=question_category_options,
+                key=f"question_category_{index}"
+            )
+            # If 'Other' is selected, display a text input for the custom category
+            other_category = ""
+            if 'Other' in question_category:
+                other_category = st.text_input(
+                    "Please specify the other category:",
+                    key=f"other_category_{index}"
+                )
+            human_defuse_label_options = ["Did not select", "Yes", "No"]
+            human_defuse_label = st.radio(
+                "Did the LLM's response defuse the confusion?",
+                human_defuse_label_options,
+                key=f"human_defuse_label_{index}",
+            )
+            submit_button = st.form_submit_button(label='Submit')
+            if submit_button:
+                if human_defuse_label == "Did not select":
+                    st.info("Please select 'Yes' or 'No' before submitting.")
+                else:
+                    if 'Other' in question_category:
+                        if other_category:
+                            question_category.remove('Other')  # Remove 'Other' placeholder
+                            question_category.append(other_category)  # Add the custom category
+                        else:
+                            st.error("Please specify the 'Other' category.")
+                            st.stop()
+
+                    question_category_str = ', '.join(question_category) if question_category else "Did not select"
+
+                    # When the submit button is clicked, append the data to the CSV
+                    row_data = {
+                        'doc_id': doc_id,
+                        'q_id': q_id,
+                        'supposed_to_be_confusing': supposed_to_be_confusing,
+                        'llm_confuse_label': llm_confuse_label,
+                        'human_confuse_label': human_confuse_label,
+                        'human_defuse_label': human_defuse_label,
+                        'question_category': question_category_str
+                    }
+                    append_row_to_csv(csv_path, row_data)
+
+def confirm_confusing(human_confuse_label_key, form1_submitted_key):
+    # Runs before the rerun, so the follow-up form shows up on the first click
+    if st.session_state[human_confuse_label_key] == "Yes":
+        st.session_state[form1_submitted_key] = True
+
+# Only the current question's widgets are rendered, so reruns do not grow with the document
+def show_question_page(qrc_data, doc_id, csv_path):
+    selected_qrc = select_questions(qrc_data, doc_id)
+    if selected_qrc.empty:
+        st.write("No data found for the selected document and confusion status.")
+        return
+
+    page_key = f"question_page_{doc_id}"
+    if page_key not in st.session_state:
+        st.session_state[page_key] = 0
+    index = min(st.session_state[page_key], len(selected_qrc) - 1)
+    forget_questions_outside_window(index)
+
+    prev_col, next_col, jump_col = st.columns(3)
+    prev_col.button("Prev", on_click=set_question_page, args=(page_key, index - 1), disabled=index == 0)
+    next_col.button("Next", on_click=set_question_page, args=(page_key, index + 1), disabled=index == len(selected_qrc) - 1)
+    jump_col.button("Next unannotated", on_click=jump_to_next_unannotated, args=(page_key, doc_id, selected_qrc, index))
+    st.caption(f"Question {index + 1} of {len(selected_qrc)}")
+
+    show_question_and_annotation_form(selected_qrc.iloc[index], index, doc_id, csv_path)
+
+def set_question_page(page_key, index):
+    st.session_state[page_key] = index
+
+def jump_to_next_unannotated(page_key, doc_id, selected_qrc, index):
+    table = st.session_state.completion_index['table']
+    remaining = table.at[doc_id, 'remaining'] if doc_id in table.index else []
+    if not remaining:
+        return
+    current_number = selected_qrc['question_number'].iloc[index]
+    # Wrap around to the first unannotated question
+    target_number = next((number for number in remaining if number > current_number), remaining[0])
+    st.session_state[page_key] = int(np.flatnonzero(selected_qrc['question_number'].to_numpy() == target_number)[0])
+
+def forget_questions_outside_window(index, window=2):
+    # Two-step form progress is kept only for questions near the current one
+    for key in [key for key in st.session_state if key.startswith("form1_submitted_")]:
+        if abs(int(key[len("form1_submitted_"):]) - index) > window:
+            del st.session_state[key]
+
+@st.cache_resource
+def get_prefetcher():
+    # Shared by every session. Worker threads only read files and DataFrames,
+    # they never call st.* since they have no script run context.
+    return {
+        'pool': ThreadPoolExecutor(max_workers=2),
+        'lock': threading.Lock(),
+        'questions': OrderedDict(),
+        'pending': set(),
+    }
+
+def select_questions(qrc_data, doc_id):
+    # Read-only, the same DataFrame may be handed to several sessions
+    prefetcher = get_prefetcher()
+    key = (id(qrc_data), doc_id)
+    with prefetcher['lock']:
+        cached = prefetcher['questions'].get(key)
+        if cached is not None and cached[0]() is qrc_data:
+            prefetcher['questions'].move_to_end(key)
+            return cached[1]
+    selected_qrc = qrc_data[qrc_data["doc_id"] == doc_id].reset_index(drop=True)
+    remember_questions(prefetcher, key, qrc_data, selected_qrc)
+    return selected_qrc
+
+def remember_questions(prefetcher, key, qrc_data, selected_qrc):
+    with prefetcher['lock']:
+        # A weak reference, so a recycled id() can never match another topic but a
+        # topic dropped from the topic cache is not kept alive by its slices
+        prefetcher['questions'][key] = (weakref.ref(qrc_data), selected_qrc)
+        prefetcher['questions'].move_to_end(key)
+        for stale in [k for k, (topic, _) in prefetcher['questions'].items() if topic() is None]:
+            del prefetcher['questions'][stale]
+        while len(prefetcher['questions']) > prefetch_max_entries:
+            prefetcher['questions'].popitem(last=False)
+
+def prefetch_next_documents(data_dir, doc_data, qrc_data, completion_index, doc_id, count=2):
+    # Warm the next unannotated documents in sidebar order while the annotator works
+    doc_ids = list(doc_data["doc_id"].unique())
+    position = doc_ids.index(doc_id)
+    following = doc_ids[position + 1:] + doc_ids[:position]
+    next_doc_ids = [
+        next_doc_id for next_doc_id in following
+        if not check_if_document_fully_annotated(completion_index, next_doc_id, return_bool=True)
+    ][:count]
+
+    doc_path = join(data_dir, "docs_out.csv")
+    stamp = file_stamp(doc_path)
+    # Workers get the offset index and the body cache from here, they cannot
+    # call st.cache_resource functions themselves
+    document_offsets = load_document_offsets(doc_path, stamp)
+    document_bodies = get_document_bodies()
+    prefetcher = get_prefetcher()
+    for next_doc_id in next_doc_ids:
+        key = (id(qrc_data), next_doc_id)
+        with prefetcher['lock']:
+            if key in prefetcher['questions'] or key in prefetcher['pending']:
+                continue
+            prefetcher['pending'].add(key)
+        prefetcher['pool'].submit(prefetch_document, prefetcher, key, document_bodies, document_offsets,
+                                  (doc_path, stamp, str(next_doc_id)), qrc_data, next_doc_id)
+
+def prefetch_document(prefetcher, key, document_bodies, document_offsets, body_key, qrc_data, doc_id):
+    try:
+        read_document_body(document_bodies, document_offsets, body_key)
+        selected_qrc = qrc_data[qrc_data["doc_id"] == doc_id].reset_index(drop=True)
+        remember_questions(prefetcher, key, qrc_data, selected_qrc)
+    finally:
+        with prefetcher['lock']:
+            prefetcher['pending'].discard(key)
+
+@st.cache_resource
+def get_profiler():
+    # Process-wide: recent phase timings for the panel and the slowest cProfile dumps
+    return {
+        'lock': threading.Lock(),
+        'recent': deque(maxlen=5000),
+        'slowest': [],
+        'topic_loads': 0,
+    }
+
+@st.cache_resource
+def get_profile_logger(log_path):
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    logger = logging.getLogger("annotate_app.profile")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler = logging.handlers.RotatingFileHandler(log_path, maxBytes=10_000_000, backupCount=5)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    return logger
+
+def profile_options():
+    options = {os.environ.get("ANNOTATE_PROFILE", ""), st.query_params.get("profile", "")}
+    return {
+        'log': bool(options - {"", "0"}),
+        'panel': "panel" in options,
+        'cprofile': "1" in {os.environ.get("ANNOTATE_CPROFILE", ""), st.query_params.get("cprofile", "")},
+    }
+
+def start_profile():
+    options = profile_options()
+    if not (options['log'] or options['cprofile']):
+        st.session_state.profile = None
+        return None
+    if 'profile_session' not in st.session_state:
+        st.session_state.profile_session = uuid.uuid4().hex[:12]
+    profile = {
+        'options': options,
+        'rerun': uuid.uuid4().hex[:12],
+        'start': time.perf_counter(),
+        'cprofile': None,
+        # Read now, st.session_state raises once st.stop()/st.rerun() ends the run
+        'session': st.session_state.profile_session,
+        'annotator': st.session_state.get('annotator_name'),
+    }
+    if options['cprofile']:
+        profile['cprofile'] = cProfile.Profile()
+        try:
+            profile['cprofile'].enable()
+        except ValueError:
+            # Another session's rerun is already being profiled
+            profile['cprofile'] = None
+    st.session_state.profile = profile
+    return profile
+
+@contextmanager
+def profile_phase(name):
+    # Yields a dict for extra fields of the record, e.g. cache hit or miss
+    extra = {}
+    profile = st.session_state.get('profile')
+    if profile is None:
+        yield extra
+        return
+    start = time.perf_counter()
+    try:
+        yield extra
+    finally:
+        record_phase(profile, name, (time.perf_counter() - start) * 1000, extra)
+
+def record_phase(profile, name, ms, extra):
+    profiler = get_profiler()
+    with profiler['lock']:
+        profiler['recent'].append((name, ms))
+    if profile['options']['log']:
+        record = {
+            'ts': time.time(),
+            'session': profile['session'],
+            'annotator': profile['annotator'],
+            'rerun': profile['rerun'],
+            'phase': name,
+            'ms': round(ms, 3),
+            **extra,
+        }
+        get_profile_logger(profile_log_path).info(json.dumps(record, default=plain_value))
+
+def finish_profile(profile, name="rerun", show_panel=False):
+    if profile is None:
+        return
+    total_ms = (time.perf_counter() - profile['start']) * 1000
+    record_phase(profile, name, total_ms, {})
+    if profile['cprofile'] is not None:
+        profile['cprofile'].disable()
+        keep_if_slowest(profile['cprofile'], total_ms, profile['rerun'])
+    if show_panel and profile['options']['panel']:
+        show_profile_panel()
+
+@contextmanager
+def profile_rerun(name="rerun"):
+    # Around the whole script, and around fragments so a fragment-only rerun (a
+    # submit) gets its own record; a fragment drawn during a full run adds nothing.
+    # Finished in finally since st.stop() and st.rerun() end a run by raising.
+    if profiled_run['active']:
+        yield
+        return
+    profile = start_profile()
+    profiled_run['active'] = True
+    completed = False
+    try:
+        yield
+        completed = True
+    finally:
+        profiled_run['active'] = False
+        # Only a run that finished can still draw, and fragments cannot write to the sidebar
+        finish_profile(profile, name, show_panel=completed and name == "rerun")
+
+def keep_if_slowest(profiler_run, total_ms, rerun):
+    profiler = get_profiler()
+    with profiler['lock']:
+        slowest = profiler['slowest']
+        if len(slowest) >= profile_slowest_kept and total_ms <= slowest[0][0]:
+            return
+        dump_path = join(os.path.dirname(profile_log_path), f"rerun_{int(total_ms)}ms_{rerun}.prof")
+        os.makedirs(os.path.dirname(dump_path), exist_ok=True)
+        profiler_run.dump_stats(dump_path)
+        slowest.append((total_ms, dump_path))
+        slowest.sort()
+        while len(slowest) > profile_slowest_kept:
+            _, evicted = slowest.pop(0)
+            if exists(evicted):
+                os.remove(evicted)
+
+def show_profile_panel():
+    profiler = get_profiler()
+    with profiler['lock']:
+        recent = pd.DataFrame(list(profiler['recent']), columns=['phase', 'ms'])
+    with st.sidebar.expander("Profiling (this server)"):
+        if recent.empty:
+            st.write("No timings yet.")
+            return
+        summary = recent.groupby('phase', sort=False)['ms'].agg(
+            n='count',
+            p50=lambda ms: np.percentile(ms, 50),
+            p95=lambda ms: np.percentile(ms, 95),
+        )
+        st.dataframe(summary.round(1))
+
+def show_progress_dashboard(cwd, experiment_folder):
+    st.write("### Labeling progress")
+    summary = refresh_progress_summary(cwd, join(cwd, experiment_folder))
+    if not summary['rows']:
+        st.info("No annotations found yet.")
+        return
+    progress = pd.DataFrame(list(summary['rows'].values()))
+    experiments = st.multiselect("Experiments:", sorted(progress['experiment'].unique()))
+    if experiments:
+        progress = progress[progress['experiment'].isin(experiments)]
+    progress['progress_%'] = (100 * progress['labeled'] / progress['questions'].where(progress['questions'] > 0)).round(1)
+    progress['confusing_rate'] = (progress['confusing'] / progress['labeled'].where(progress['labeled'] > 0)).round(3)
+    progress['defused_rate'] = (progress['defused'] / progress['confusing'].where(progress['confusing'] > 0)).round(3)
+    st.dataframe(
+        progress[['experiment', 'topic', 'annotator', 'labeled', 'questions', 'progress_%', 'confusing_rate', 'defused_rate']]
+        .sort_values(['experiment', 'topic', 'annotator']),
+        hide_index=True,
+    )
+
+def refresh_progress_summary(cwd, base_path):
+    # Persisted between runs; an entry is recomputed only when its qrc_out.csv or
+    # the annotator's labels changed, so a refresh is mostly stat calls
+    summary = {'rows': {}}
+    if exists(progress_summary_path):
+        with open(progress_summary_path) as f:
+            summary = json.load(f)
+    catalog = get_experiment_catalog(base_path)
+    changed = False
+    seen = set()
+    exp_folders = list_subdirs(catalog, base_path)
+    for exp_name in exp_folders:
+        experiment_dir = join(base_path, exp_name)
+        topics = {}
+        for topic in list_subdirs(catalog, experiment_dir):
+            qrc_path = join(experiment_dir, topic, "qrc_out.csv")
+            if exists(qrc_path):
+                topics[topic] = (qrc_path, file_stamp(qrc_path))
+        for annotator, labels_stamp, load_labels in label_sources(cwd, exp_name, exp_folders):
+            labels = None
+            for topic, (qrc_path, qrc_stamp) in topics.items():
+                key = f"{exp_name}/{topic}/{annotator}"
+                seen.add(key)
+                # Through JSON so it compares equal to what was read back from disk
+                stamps = json.loads(json.dumps([qrc_stamp, labels_stamp]))
+                if key in summary['rows'] and summary['rows'][key]['stamps'] == stamps:
+                    continue
+                if labels is None:
+                    labels = load_labels()
+                summary['rows'][key] = {
+                    'experiment': exp_name,
+                    'topic': topic,
+                    'annotator': annotator,
+                    **summarize_labels(topic_question_keys(qrc_path, qrc_stamp), labels),
+                    'stamps': stamps,
+                }
+                changed = True
+    for key in set(summary['rows']) - seen:
+        del summary['rows'][key]
+        changed = True
+
+    if changed:
+        try:
+            with atomic_write(progress_summary_path) as f:
+                json.dump(summary, f)
+        except OSError:
+            # Read-only working directory, recomputed next time
+            pass
+    return summary
+
+def label_sources(cwd, exp_name, exp_folders):
+    # (annotator, stamp, loader) for everyone who labeled this experiment;
+    # loader returns {(doc_id, q_id, supposed_to_be_confusing): row}
+    if annotation_storage == "sqlite":
+        db = get_annotation_db(annotation_db_path)
+        with db['lock']:
+            annotators = db['conn'].execute(
+                "SELECT annotator, COUNT(*), MAX(updated_at) FROM annotations WHERE experiment = ? GROUP BY annotator",
+                [exp_name],
+            ).fetchall()
+        return [
+            (annotator, [count, updated_at], lambda annotator=annotator: sqlite_label_rows(annotator, exp_name))
+            for annotator, count, updated_at in annotators
+        ]
+
+    return [
+        (annotator, annotations_stamp(path), lambda path=path: stored_label_rows(path))
+        for annotator, path in find_labels_files(cwd, exp_name, exp_folders).items()
     ]
-    annotations_df = pd.DataFrame(columns=columns)
 
-# Select doc_id with checkmarks
-doc_id = select_doc_id_with_checkmarks(doc_data, qrc_data, annotations_df)
+def stored_label_rows(csv_path):
+    # Stores are never evicted, so only annotators active in this process are read
+    # through theirs; everyone else's labels are read once and let go
+    annotation_store = get_annotation_stores().get(csv_path)
+    if annotation_store is None:
+        return annotation_rows_by_key(read_annotation_files(csv_path))
+    sync_annotation_store(annotation_store, csv_path)
+    with annotation_store['lock']:
+        return dict(annotation_store['rows'])
 
-left, right = st.columns([2 , 1.5])  # these numbers represent proportions
+def sqlite_label_rows(annotator, exp_name):
+    return annotation_rows_by_key(read_sqlite_annotations((annotator, exp_name)))
 
-with left:
-    show_instructions()
-    show_doc_contents(doc_data, doc_id)
-    
-with right:
-    show_question_contents_and_annotation_form(qrc_data, doc_id, csv_path, annotations_df)
+@st.cache_resource(max_entries=256)
+def topic_question_keys(qrc_path, stamp):
+    keys = pd.read_csv(qrc_path, usecols=['doc_id', 'q_id', 'is_confusing'])
+    return set(zip(keys['doc_id'], keys['q_id'], keys['is_confusing']))
+
+def summarize_labels(question_keys, labels):
+    labeled = [row for key, row in labels.items() if key in question_keys]
+    return {
+        'questions': len(question_keys),
+        'labeled': len(labeled),
+        'confusing': sum(row['human_confuse_label'] == "Yes" for row in labeled),
+        'defused': sum(row['human_defuse_label'] == "Yes" for row in labeled),
+    }
+
+######## Script Below ###########
+
+# Everything below is one profiled run, see profile_rerun
+with profile_rerun():
+    with profile_phase("init"):
+        cwd = init() 
+
+    if st.sidebar.radio("View:", ["Annotate", "Progress dashboard"], horizontal=True) == "Progress dashboard":
+        with profile_phase("progress_dashboard"):
+            show_progress_dashboard(cwd, experiment_folder)
+        st.stop()
+
+    # Sidebar logic to select experiment and topic
+    with profile_phase("sidebar_logic"):
+        exp_name, data_dir = sidebar_logic(cwd, experiment_folder)
+
+    # Now we can get the CSV path since we have exp_name
+    with profile_phase("check_username_csv_path"):
+        csv_path = check_username_csv_path(cwd, exp_name)
+
+    # Load data
+    with profile_phase("load_csv_data") as phase:
+        topic_loads = get_profiler()['topic_loads']
+        stamps = topic_stamps(data_dir)
+        doc_data, qrc_data = load_csv_data(data_dir)
+        phase['cache'] = "hit" if get_profiler()['topic_loads'] == topic_loads else "miss"
+    record_topic_counts(get_experiment_catalog(join(cwd, experiment_folder)), data_dir, stamps, doc_data, qrc_data)
+
+    # Load annotations DataFrame
+    with profile_phase("load_annotations"):
+        annotation_store = get_annotation_store(csv_path)
+        sync_annotation_store(annotation_store, csv_path)
+
+    if annotation_storage == "sqlite" and st.sidebar.button("Export labels CSV"):
+        export_sqlite_annotations(st.session_state.annotation_owner, csv_path)
+        st.sidebar.success(f"Exported to {export_path(csv_path)}")
+
+    # Select doc_id with checkmarks
+    with profile_phase("select_doc_id_with_checkmarks"):
+        # Per-document completion, built once and updated as annotations are saved
+        completion_index = get_completion_index(data_dir, csv_path, qrc_data, annotation_store)
+        if queue_target_labels > 0:
+            doc_id = select_doc_id_from_queue(cwd, exp_name, data_dir, doc_data, qrc_data, completion_index)
+        else:
+            doc_id = select_doc_id_with_checkmarks(doc_data, completion_index)
+
+    if queue_target_labels == 0:
+        with profile_phase("search"):
+            show_search(data_dir, qrc_data)
+
+    one_question_at_a_time = st.sidebar.checkbox("Show one question at a time", key="one_question_at_a_time")
+
+    with profile_phase("render"):
+        left, right = st.columns([2 , 1.5])  # these numbers represent proportions
+
+        with left:
+            show_instructions()
+            show_doc_contents(data_dir, doc_id)
+
+        with right:
+            # Left over from a submit that finished the document
+            if "flash_message" in st.session_state:
+                st.success(st.session_state.pop("flash_message"))
+            if one_question_at_a_time:
+                show_question_page(qrc_data, doc_id, csv_path)
+            else:
+                show_question_contents_and_annotation_form(qrc_data, doc_id, csv_path)
+
+    # Get the next documents ready in the background once this one is on screen
+    prefetch_next_documents(data_dir, doc_data, qrc_data, completion_index, doc_id)
@@ -0,0 +1,235 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from os.path import abspath, dirname, join
+
+import numpy as np
+import pandas as pd
+
+# Reproducible timings for annotate_app.py on a synthetic experiment tree.
+#
+#   python benchmark.py --docs 500 --questions 20 --out bench.json
+#   python benchmark.py --docs 500 --questions 20 --compare bench.json
+#
+# The app is driven headlessly through streamlit's AppTest for cold start,
+# reruns, document switches and submits; load_csv_data, the completion index
+# and select_doc_id_with_checkmarks are also timed on their own.
+
+app_path = join(dirname(abspath(__file__)), "annotate_app.py")
+
+
+def generate_experiment(root, exp_name="bench", topics=1, docs=200, questions=10, doc_words=800,
+                        annotator="bench", labeled=0.5, seed=0):
+    # experiment/<exp>/<topic>/{docs_out,qrc_out}.csv plus a labels CSV in root
+    # with a `labeled` fraction of the questions already annotated
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([f"word{i}" for i in range(5000)])
+    labels = []
+    for t in range(topics):
+        data_dir = join(root, "experiment", exp_name, f"topic{t}")
+        os.makedirs(data_dir, exist_ok=True)
+        doc_ids = np.arange(1, docs + 1) + t * docs
+        documents = [
+            " ".join(rng.choice(vocabulary, doc_words)) + '\n"quoted", second paragraph'
+            for _ in doc_ids
+        ]
+        pd.DataFrame({"doc_id": doc_ids, "document": documents}).to_csv(join(data_dir, "docs_out.csv"), index=False)
+
+        n = docs * questions
+        is_confusing = np.tile([True, False], n // 2 + 1)[:n]
+        qrc = pd.DataFrame({
+            "doc_id": np.repeat(doc_ids, questions),
+            "q_id": np.tile(np.arange(questions) // 2, docs),
+            "is_confusing": is_confusing,
+            "question": [f"Question {i} about " + " ".join(rng.choice(vocabulary, 15)) + "?" for i in range(n)],
+            "response": [" ".join(rng.choice(vocabulary, 60)) for _ in range(n)],
+            "confusion": np.where(is_confusing, "Yes\nThe question assumes something false", "No\nThe question is fine"),
+            "is_defused": rng.choice(["Yes", "No"], n),
+        })
+        qrc.to_csv(join(data_dir, "qrc_out.csv"), index=False)
+
+        done = qrc.sample(frac=labeled, random_state=seed)
+        labels.append(pd.DataFrame({
+            "doc_id": done["doc_id"],
+            "q_id": done["q_id"],
+            "supposed_to_be_confusing": done["is_confusing"],
+            "llm_confuse_label": done["confusion"].str.split("\n").str[0],
+            "human_confuse_label": "No",
+            "human_defuse_label": "Did not select",
+            "question_category": "",
+        }))
+    pd.concat(labels, ignore_index=True).to_csv(join(root, f"{annotator}_{exp_name}_labels.csv"), index=False)
+
+
+def load_app_functions():
+    # Everything above the "Script Below" marker: the app's functions without running the page
+    with open(app_path) as f:
+        source = f.read().split("######## Script Below ###########")[0]
+    namespace = {"__name__": "annotate_app_functions"}
+    exec(compile(source, app_path, "exec"), namespace)
+    return namespace
+
+
+def timed(timings, name, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    timings.setdefault(name, []).append((time.perf_counter() - start) * 1000)
+    return result
+
+
+def find_button(at, label):
+    return next(button for button in at.button if button.label == label)
+
+
+def open_unannotated_question(at):
+    # Every timed submit is a question's first label through form 1, never an
+    # overwrite or form 2, so app_submit times the same path on every commit
+    doc_select = at.sidebar.selectbox[2]
+    if doc_select.value.startswith("✅"):
+        label = next((label for label in doc_select.options if not label.startswith("✅")), None)
+        if label is None:
+            raise RuntimeError("Every document is annotated, generate fewer --labeled questions")
+        doc_select.set_value(label)
+        at.run()
+    find_button(at, "Next unannotated").click()
+    at.run()
+    page = at.session_state[f"question_page_{at.sidebar.selectbox[2].value}"]
+    # form1_submitted_{page} is keyed by page alone, a "No" on the same page of an
+    # earlier document would show form 2 here
+    if at.session_state[f"form1_submitted_{page}"]:
+        at.session_state[f"form1_submitted_{page}"] = False
+        at.run()
+    return next(radio for radio in at.radio if radio.key == f"human_confuse_label_{page}")
+
+
+def bench_functions(timings, data_dir, csv_path, repeat):
+    import streamlit as st
+    app = load_app_functions()
+
+    for _ in range(repeat):
+        # Cold: no Arrow conversion, offset index or process cache yet
+        for leftover in os.listdir(data_dir):
+            if leftover.endswith((".arrow", ".offsets.json")):
+                os.remove(join(data_dir, leftover))
+        st.cache_resource.clear()
+        timed(timings, "load_csv_data_cold", app["load_csv_data"], data_dir)
+        st.cache_resource.clear()
+        timed(timings, "load_csv_data_converted", app["load_csv_data"], data_dir)
+        doc_data, qrc_data = timed(timings, "load_csv_data_warm", app["load_csv_data"], data_dir)
+
+        annotations_df = pd.read_csv(csv_path)
+        annotated_questions = set(zip(annotations_df['doc_id'], annotations_df['q_id'], annotations_df['supposed_to_be_confusing']))
+        completion_index = timed(timings, "build_completion_index", app["build_completion_index"], qrc_data, annotated_questions)
+        timed(timings, "select_doc_id_with_checkmarks", app["select_doc_id_with_checkmarks"], doc_data, completion_index)
+
+
+def bench_app(timings, annotator, repeat, submits):
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    for _ in range(repeat):
+        st.cache_resource.clear()
+        at = AppTest.from_file(app_path, default_timeout=600)
+        at.session_state["annotator_name"] = annotator
+        at.session_state["one_question_at_a_time"] = True
+        timed(timings, "app_cold_start", at.run)
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        timed(timings, "app_rerun", at.run)
+
+        doc_select = at.sidebar.selectbox[2]
+        for label in doc_select.options[1:6]:
+            at.sidebar.selectbox[2].set_value(label)
+            timed(timings, "app_switch_document", at.run)
+
+        for _ in range(submits):
+            open_unannotated_question(at).set_value("No")
+            find_button(at, "Submit").click()
+            timed(timings, "app_submit", at.run)
+            if at.exception:
+                raise RuntimeError(at.exception[0].message)
+
+
+def summarize(timings):
+    return {
+        name: {
+            "runs": len(values),
+            "median_ms": round(statistics.median(values), 3),
+            "min_ms": round(min(values), 3),
+            "max_ms": round(max(values), 3),
+        }
+        for name, values in timings.items()
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=dirname(app_path),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"{'timing':32} {'baseline ms':>12} {'now ms':>12} {'ratio':>8}")
+    for name, now in results["timings"].items():
+        before = baseline["timings"].get(name)
+        if before is None:
+            continue
+        ratio = now["median_ms"] / before["median_ms"] if before["median_ms"] else float("nan")
+        print(f"{name:32} {before['median_ms']:12.2f} {now['median_ms']:12.2f} {ratio:8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark annotate_app.py on a synthetic experiment")
+    parser.add_argument("--topics", type=int, default=1)
+    parser.add_argument("--docs", type=int, default=200, help="Documents per topic")
+    parser.add_argument("--questions", type=int, default=10, help="Questions per document")
+    parser.add_argument("--doc-words", type=int, default=800, help="Words per document")
+    parser.add_argument("--labeled", type=float, default=0.5, help="Fraction of questions already labeled")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--submits", type=int, default=10)
+    parser.add_argument("--storage", default="csv", help="ANNOTATION_STORAGE for the app runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Keep the generated tree here instead of a temporary folder")
+    parser.add_argument("--out", help="Write the results as JSON")
+    parser.add_argument("--compare", help="Results JSON from another commit to compare against")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="annotate_bench_")
+    annotator, exp_name = "bench", "bench"
+    generate_experiment(workdir, exp_name, args.topics, args.docs, args.questions, args.doc_words,
+                        annotator, args.labeled, args.seed)
+
+    # The app finds experiment/ and the labels CSV relative to the working directory
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    os.environ["ANNOTATION_STORAGE"] = args.storage
+    timings = {}
+    try:
+        bench_functions(timings, join(workdir, "experiment", exp_name, "topic0"),
+                        join(workdir, f"{annotator}_{exp_name}_labels.csv"), args.repeat)
+        bench_app(timings, annotator, args.repeat, args.submits)
+    finally:
+        os.chdir(previous_cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {"commit": git_commit(), "config": vars(args), "timings": summarize(timings)}
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results["timings"], indent=2))
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import glob
+from os.path import basename, join
+
+
+def find_labels_files(labels_dir, exp_name, experiment_names=()):
+    # annotator -> {annotator}_{exp}_labels.csv in labels_dir. Experiment "a_b"'s
+    # files also end in "_b_labels.csv", so for experiment "b" a match is skipped
+    # when it belongs to another known experiment whose name ends in "_b".
+    suffix = f"_{exp_name}_labels.csv"
+    longer_suffixes = [
+        f"_{other}_labels.csv" for other in experiment_names
+        if other != exp_name and other.endswith(f"_{exp_name}")
+    ]
+    labels_files = {}
+    for path in sorted(glob.glob(join(glob.escape(labels_dir), f"*{suffix}"))):
+        filename = basename(path)
+        if any(filename.endswith(longer_suffix) for longer_suffix in longer_suffixes):
+            continue
+        labels_files[filename[:-len(suffix)]] = path
+    return labels_files